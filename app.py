@@ -1,14 +1,28 @@
 #Waiter End Point that interacts with Telegram Bot API
+import sys
 
-from secrets_handler import check_required_secrets
-check_required_secrets()
+from startup import phase, warm_up, report
+from secrets_handler import check_required_secrets, get_setting
+with phase('secrets'):
+    check_required_secrets()
 
-from flask import Flask, request, Response
-from waiter import main as waiter
-from waiter.helper import report_reception,report_balance
-from telegram.bot import logger
+with phase('import flask'):
+    from flask import Flask, request, Response, jsonify
+with phase('import cook'):
+    from cook.main import req
+with phase('import reception'):
+    from reception.main import reception_api
+with phase('import waiter'):
+    from waiter import main as waiter
+    from waiter.helper import report_reception,report_balance,report_health,report_stats
+    from waiter.cook_helper import serviceOps
+from telegram.bot import bot as telegram_bot, logger
 
-import threading
+# Build the singletons in the background instead of on the first request
+STARTUP_WARMUP = get_setting('STARTUP_WARMUP', True)
+PROFILE_STARTUP = __name__ == '__main__' and '--profile-startup' in sys.argv
+# Receive the updates by long polling instead of the webhook
+POLL = __name__ == '__main__' and '--poll' in sys.argv
 
 app = Flask(__name__)
 
@@ -19,15 +33,21 @@ def index():
 @app.route('/bot',methods=['POST','GET'])
 def bot():
     if request.method == 'POST':
-        data = request.get_json()
-        try:
-            thread = threading.Thread(target=waiter.workOn,args=(data,))
-            thread.start()
-        except Exception as e:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
             logger.warning("Invalid request from Telegram")
             print(data)
-        finally:
             return "Request Processed"
+        if not waiter.acceptUpdate(data):
+            return "Request Processed"
+        if not waiter.updates.submit(data):
+            # Answered in the webhook's response, without a call of our own
+            reply = waiter.busyReply(data)
+            logger.warning("Shed update %s, every worker is busy", data.get('update_id'))
+            if reply is not None:
+                method, payload = reply
+                return jsonify(dict(payload, method=method))
+        return "Request Processed"
     else:
         print("Working from url :",request.base_url)
         return "<h1>Server is Working Fine</h1>"
@@ -45,9 +65,34 @@ def manualset():
 
 @app.route('/checkreport')
 def check_report():
-    return Response([report_balance(),report_reception()])
+    return Response([report_balance(),report_health(),report_reception()])
+
+@app.route('/stats')
+def stats():
+    return jsonify(report_stats())
+
+
+def profile_startup():
+    """Builds every singleton in turn and prints the time of each phase"""
+    for item in (serviceOps, req, reception_api):
+        try:
+            item.get()
+        except Exception as e:
+            print(f"{item._name} failed: {e!r}")
+    print(report())
+
+
+if PROFILE_STARTUP:
+    profile_startup()
+    sys.exit(0)
+elif STARTUP_WARMUP:
+    warm_up(serviceOps, req, reception_api, then=telegram_bot.announce_start)
 
 
 if __name__=='__main__':
-    app.run(debug=True,port=5000)
+    if POLL:
+        from waiter.polling import main as poll
+        poll()
+    else:
+        app.run(debug=True,port=5000)
 
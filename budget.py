@@ -0,0 +1,148 @@
+"""Time budget of the update being processed.
+
+waiter.main.workOn opens a budget for each update, every outbound call
+made while handling it (providers, BharatPe, Telegram) takes its timeout
+from what is left, and raises BudgetExhausted once nothing is left."""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from secrets_handler import get_setting
+
+UPDATE_BUDGET = get_setting('UPDATE_BUDGET', 25.0)
+
+
+class BudgetExhausted(Exception):
+    """Raised by an outbound call when the update has no time left"""
+
+
+class timeBudget:
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.deadline = self.started + seconds
+        self.stages: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def timeout(self, default):
+        """Caps a requests timeout, a number or a (connect, read) tuple, to the time left"""
+        left = self.remaining()
+        if left <= 0:
+            raise BudgetExhausted(f"The {self.seconds}s budget is used up")
+        if isinstance(default, tuple):
+            return tuple(min(part, left) for part in default)
+        return min(default, left)
+
+    def spend(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+class budgetStats:
+    """Time spent per stage over all the updates, to tune the budget"""
+
+    def __init__(self) -> None:
+        self.updates = 0
+        self.exhausted = 0
+        self.used = 0.0
+        self.stages: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, spent: timeBudget, exhausted: bool):
+        with self._lock:
+            self.updates += 1
+            self.exhausted += int(exhausted)
+            self.used += min(time.monotonic() - spent.started, spent.seconds) / spent.seconds
+            for stage, seconds in spent.stages.items():
+                total = self.stages.setdefault(stage, {'updates': 0, 'seconds': 0.0, 'max': 0.0})
+                total['updates'] += 1
+                total['seconds'] += seconds
+                total['max'] = max(total['max'], seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'updates': self.updates,
+                'exhausted': self.exhausted,
+                'avg_used': round(self.used / self.updates, 3) if self.updates else 0.0,
+                'stages': {
+                    stage: {
+                        'avg': round(total['seconds'] / total['updates'], 3),
+                        'max': round(total['max'], 3),
+                    }
+                    for stage, total in self.stages.items()
+                },
+            }
+
+
+_current = contextvars.ContextVar('budget', default=None)
+# Seconds spent in the stages nested in the running one
+_nested = contextvars.ContextVar('stage', default=None)
+_nested_lock = threading.Lock()
+budget_stats = budgetStats()
+
+
+def current() -> timeBudget | None:
+    return _current.get()
+
+
+@contextmanager
+def begin(seconds: float = UPDATE_BUDGET):
+    """Opens the budget of an update for the code run inside the block"""
+    spent = timeBudget(seconds)
+    token = _current.set(spent)
+    exhausted = False
+    try:
+        yield spent
+    except BudgetExhausted:
+        exhausted = True
+        raise
+    finally:
+        _current.reset(token)
+        budget_stats.record(spent, exhausted)
+
+
+@contextmanager
+def outside():
+    """Runs the block without the open budget, for calls that must be made
+    whatever time is left, like delivering what the user already paid for"""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def timeout(default):
+    """The timeout for an outbound call, the default when no budget is open"""
+    spent = current()
+    if spent is None:
+        return default
+    return spent.timeout(default)
+
+
+@contextmanager
+def stage(name: str):
+    """Adds the time spent inside the block to the stage of the open budget,
+    less the time of the stages nested in it, so no second counts twice"""
+    spent = current()
+    outer = _nested.get()
+    nested = [0.0]
+    token = _nested.set(nested)
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - started
+        _nested.reset(token)
+        with _nested_lock:
+            if outer is not None:
+                outer[0] += elapsed
+            # Calls made in parallel can add up to more than the block took
+            own = max(elapsed - nested[0], 0.0)
+        if spent is not None:
+            spent.spend(name, own)
@@ -0,0 +1,19 @@
+"""Stand-in secrets for the tests, the modules read them on import"""
+import os
+
+SECRETS = {
+    'BOT_TOKEN': 'bot_token',
+    'POSTGRESQL_DB': 'sqlite://',
+    'PROFIT_RATE': '30',
+    'FASTSMS_API': 'fastsms_api',
+    'FIVESIM_API': 'fivesim_api',
+    'TIGER_API': 'tiger_api',
+    'BOWER_API': 'bower_api',
+    'BHARATPE_MERCHANT_ID': 'bharatpe_merchant_id',
+    'BHARATPE_TOKEN': 'bharatpe_token',
+}
+for secret, value in SECRETS.items():
+    os.environ.setdefault(secret, value)
+
+from secrets_handler import check_required_secrets
+check_required_secrets()
@@ -0,0 +1,272 @@
+"""Precompiled catalogue, built once and memory mapped read-only by every worker.
+
+    python -m cook.artifact build [--menu waiter/menu.txt] [--out cook/catalogue.bin]
+
+Layout, little endian: a header (magic, version, build time, section count),
+a directory of (name, offset) per section, then the sections. A section is
+either a string table (count, count + 1 offsets into a utf-8 blob) or an
+array of u32. Sections:
+
+    code    service codes, in menu order
+    name    service names, aligned with code
+    bycode  positions of the codes, sorted by code
+    service cook service names, sorted
+    keys    json of the server codes, aligned with service
+
+Version 2 dropped the pages of the services list, which the waiter now
+renders from the menu."""
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import struct
+import time
+from bisect import bisect_left
+from collections.abc import Mapping
+from os import path, replace
+
+from secrets_handler import get_setting
+
+# The bot's logger, taken by name so that the build command doesn't start the bot
+logger = logging.getLogger("Bot_logger")
+
+MAGIC = b'SMSCATLG'
+ARTIFACT_VERSION = 2
+HEADER = struct.Struct('<8sHdI')
+ENTRY = struct.Struct('<8sQ')
+COUNT = struct.Struct('<I')
+
+module_dir = path.dirname(path.realpath(__file__))
+ARTIFACT_PATH = get_setting('CATALOGUE_ARTIFACT', path.join(module_dir, 'catalogue.bin'))
+MENU_JSON = path.join(module_dir, 'menuList.json')
+MENU_TXT = path.join(path.dirname(module_dir), 'waiter', 'menu.txt')
+
+
+class ArtifactError(Exception):
+    """Raised when the artifact is missing, damaged or of another version"""
+
+
+def service_code(name: str) -> str:
+    """Unique 7 char key of a service name"""
+    return hashlib.sha256(name.encode()).hexdigest()[:7]
+
+
+# Writing
+
+def pack_strings(items: list[str]) -> bytes:
+    blobs = [item.encode('utf-8') for item in items]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    return COUNT.pack(len(blobs)) + struct.pack(f'<{len(offsets)}I', *offsets) + b''.join(blobs)
+
+
+def pack_u32(items: list[int]) -> bytes:
+    return COUNT.pack(len(items)) + struct.pack(f'<{len(items)}I', *items)
+
+
+def build(menu_txt: str = MENU_TXT, menu_json: str = MENU_JSON, out: str = ARTIFACT_PATH) -> str:
+    """Builds the artifact from the menu files, replacing the old one atomically"""
+    with open(menu_txt, 'r', encoding='utf-8') as file:
+        names = [line.strip() for line in file if line.strip()]
+    database = {service_code(name): name for name in names}
+    with open(menu_json, 'r', encoding='utf-8') as file:
+        menu = json.load(file)
+    codes = list(database)
+    services = sorted(menu)
+    sections = {
+        b'code': pack_strings(codes),
+        b'name': pack_strings(list(database.values())),
+        b'bycode': pack_u32(sorted(range(len(codes)), key=codes.__getitem__)),
+        b'service': pack_strings(services),
+        b'keys': pack_strings([json.dumps(menu[name], separators=(',', ':')) for name in services]),
+    }
+    offset = HEADER.size + ENTRY.size * len(sections)
+    directory, body = b'', b''
+    for name, section in sections.items():
+        directory += ENTRY.pack(name, offset + len(body))
+        body += section
+    temporary = out + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, ARTIFACT_VERSION, time.time(), len(sections)) + directory + body)
+    replace(temporary, out)
+    return out
+
+
+# Reading
+
+class stringTable:
+    def __init__(self, buffer, offset: int) -> None:
+        self.buffer = buffer
+        (self.count,) = COUNT.unpack_from(buffer, offset)
+        self.offsets = offset + COUNT.size
+        self.blob = self.offsets + 4 * (self.count + 1)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i: int) -> str:
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        start, end = struct.unpack_from('<2I', self.buffer, self.offsets + 4 * i)
+        return self.buffer[self.blob + start:self.blob + end].decode('utf-8')
+
+
+class u32Array:
+    def __init__(self, buffer, offset: int) -> None:
+        self.buffer = buffer
+        (self.count,) = COUNT.unpack_from(buffer, offset)
+        self.start = offset + COUNT.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i: int) -> int:
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return COUNT.unpack_from(self.buffer, self.start + 4 * i)[0]
+
+
+class sortedView:
+    """A sorted sequence seen through a permutation, for bisect"""
+
+    def __init__(self, items, order) -> None:
+        self.items = items
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i: int):
+        return self.items[self.order[i]]
+
+
+class codeNames(Mapping):
+    """Service code -> name, in menu order, looked up in the mapped artifact"""
+
+    def __init__(self, codes: stringTable, names: stringTable, bycode: u32Array) -> None:
+        self.codes = codes
+        self.names = names
+        self.bycode = bycode
+        self.sorted_codes = sortedView(codes, bycode)
+
+    def position(self, code) -> int:
+        i = bisect_left(self.sorted_codes, code)
+        if i < len(self.bycode) and self.sorted_codes[i] == code:
+            return self.bycode[i]
+        return -1
+
+    def __getitem__(self, code) -> str:
+        position = self.position(code) if isinstance(code, str) else -1
+        if position < 0:
+            raise KeyError(code)
+        return self.names[position]
+
+    def __contains__(self, code) -> bool:
+        return isinstance(code, str) and self.position(code) >= 0
+
+    def __iter__(self):
+        return (self.codes[i] for i in range(len(self.codes)))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def values(self):
+        return [self.names[i] for i in range(len(self.names))]
+
+    def items(self):
+        return [(self.codes[i], self.names[i]) for i in range(len(self.codes))]
+
+
+class serviceKeys(Mapping):
+    """Cook service name -> codes of the service at each server"""
+
+    def __init__(self, services: stringTable, keys: stringTable) -> None:
+        self.services = services
+        self.keys = keys
+
+    def _find(self, name) -> int:
+        i = bisect_left(self.services, name)
+        if i < len(self.services) and self.services[i] == name:
+            return i
+        return -1
+
+    def __getitem__(self, name) -> dict:
+        i = self._find(name) if isinstance(name, str) else -1
+        if i < 0:
+            raise KeyError(name)
+        return json.loads(self.keys[i])
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and self._find(name) >= 0
+
+    def __iter__(self):
+        return (self.services[i] for i in range(len(self.services)))
+
+    def __len__(self):
+        return len(self.services)
+
+
+class catalogueArtifact:
+    def __init__(self, file_path: str = ARTIFACT_PATH) -> None:
+        self.path = file_path
+        try:
+            with open(file_path, 'rb') as file:
+                self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise ArtifactError(f"Can't map {file_path}: {e}") from None
+        try:
+            magic, version, self.built, count = HEADER.unpack_from(self.buffer, 0)
+            if magic != MAGIC or version != ARTIFACT_VERSION:
+                raise ArtifactError(f"{file_path} is not a version {ARTIFACT_VERSION} catalogue")
+            sections = {}
+            for i in range(count):
+                name, offset = ENTRY.unpack_from(self.buffer, HEADER.size + ENTRY.size * i)
+                sections[name.rstrip(b'\0').decode()] = offset
+            self.database = codeNames(stringTable(self.buffer, sections['code']),
+                                      stringTable(self.buffer, sections['name']),
+                                      u32Array(self.buffer, sections['bycode']))
+            self.menu = serviceKeys(stringTable(self.buffer, sections['service']),
+                                    stringTable(self.buffer, sections['keys']))
+        except (struct.error, KeyError, UnicodeDecodeError) as e:
+            raise ArtifactError(f"{file_path} is damaged: {e!r}") from None
+
+    def is_older_than(self, *sources: str) -> bool:
+        """Whether a source file changed after the artifact was built"""
+        return any(path.isfile(source) and path.getmtime(source) > self.built for source in sources)
+
+
+_shared = {}
+
+
+def shared(file_path: str = ARTIFACT_PATH) -> catalogueArtifact | None:
+    """The artifact mapped once per process, None when it can't be used
+    and the catalogue has to be loaded from the menu files"""
+    if file_path not in _shared:
+        try:
+            artifact = catalogueArtifact(file_path)
+            if artifact.is_older_than(MENU_TXT, MENU_JSON):
+                raise ArtifactError(f"{file_path} is older than the menu, rebuild it")
+        except ArtifactError as e:
+            logger.warning("Catalogue artifact not used: %s", e)
+            artifact = None
+        _shared[file_path] = artifact
+    return _shared[file_path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the catalogue artifact")
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--menu', default=MENU_TXT, help="the service names, one per line")
+    parser.add_argument('--services', default=MENU_JSON, help="the server codes of each service")
+    parser.add_argument('--out', default=ARTIFACT_PATH)
+    args = parser.parse_args()
+    out = build(args.menu, args.services, args.out)
+    artifact = catalogueArtifact(out)
+    print(f"Built {out}: {len(artifact.database)} names, {len(artifact.menu)} services, "
+          f"{path.getsize(out)} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Circuit breakers and health scores of the provider hosts"""
+import threading
+import time
+from collections import deque
+
+from secrets_handler import get_setting
+
+BREAKER_WINDOW = get_setting('BREAKER_WINDOW', 50)
+BREAKER_MIN_CALLS = get_setting('BREAKER_MIN_CALLS', 10)
+BREAKER_ERROR_RATE = get_setting('BREAKER_ERROR_RATE', 0.5)
+BREAKER_SLOW_P95 = get_setting('BREAKER_SLOW_P95', 6.0)
+BREAKER_COOLDOWN = get_setting('BREAKER_COOLDOWN', 30.0)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class circuitBreaker:
+    """Tracks the outcome and latency of the latest calls to one host.
+
+    closed    - calls go through, it opens when the error rate or the p95
+                latency of the rolling window crosses its limit
+    open      - calls are refused until the cooldown has passed
+    half-open - one probe call goes through, closing the breaker when it
+                succeeds in time and opening it again otherwise
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, window: int = BREAKER_WINDOW,
+                 min_calls: int = BREAKER_MIN_CALLS,
+                 error_rate: float = BREAKER_ERROR_RATE,
+                 slow_p95: float = BREAKER_SLOW_P95,
+                 cooldown: float = BREAKER_COOLDOWN) -> None:
+        self.min_calls = min_calls
+        self.max_error_rate = error_rate
+        self.slow_p95 = slow_p95
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.calls = deque(maxlen=window)  # (ok, latency)
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_at = 0.0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def _error_rate(self):
+        if not self.calls:
+            return 0.0
+        return sum(1 for ok, _ in self.calls if not ok) / len(self.calls)
+
+    def _p95(self):
+        return percentile([latency for _, latency in self.calls], 0.95)
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.probing = False
+        self.trips += 1
+
+    def record(self, ok: bool, latency: float):
+        with self._lock:
+            if self.state == self.OPEN:
+                return
+            if self.state == self.HALF_OPEN:
+                if ok and latency < self.slow_p95:
+                    self.state = self.CLOSED
+                    self.calls.clear()
+                    self.calls.append((ok, latency))
+                else:
+                    self._open()
+                return
+            self.calls.append((ok, latency))
+            if len(self.calls) >= self.min_calls and (
+                    self._error_rate() >= self.max_error_rate or self._p95() >= self.slow_p95):
+                self._open()
+
+    def allow(self) -> bool:
+        """Returns whether a call may go to the host now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = self.HALF_OPEN
+                self.probing = False
+            if self.probing and time.monotonic() - self.probe_at < self.cooldown:
+                return False
+            self.probing = True
+            self.probe_at = time.monotonic()
+            return True
+
+    def is_open(self) -> bool:
+        """Whether calls are refused now. Unlike allow it takes no probe,
+        for callers that only read, like the price listing."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                return now - self.opened_at < self.cooldown
+            if self.state == self.HALF_OPEN:
+                return self.probing and now - self.probe_at < self.cooldown
+            return False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            error_rate = self._error_rate()
+            p95 = self._p95()
+            latency_factor = min(1.0, self.slow_p95 / p95) if p95 else 1.0
+            return {
+                'state': self.state,
+                'calls': len(self.calls),
+                'error_rate': round(error_rate, 3),
+                'p50': round(percentile([latency for _, latency in self.calls], 0.5), 3),
+                'p95': round(p95, 3),
+                'score': int(100 * (1 - error_rate) * latency_factor),
+                'trips': self.trips,
+            }
+
+
+class healthRegistry:
+    """One circuit breaker per host"""
+
+    def __init__(self) -> None:
+        self._breakers: dict[str, circuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def for_host(self, host: str) -> circuitBreaker:
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = circuitBreaker()
+            return self._breakers[host]
+
+    def record(self, host: str, ok: bool, latency: float):
+        self.for_host(host).record(ok, latency)
+
+
+health = healthRegistry()
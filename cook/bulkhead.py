@@ -0,0 +1,61 @@
+"""Concurrency limits for the calls to each server"""
+import threading
+import time
+
+
+class BulkheadFull(Exception):
+    """Raised when no slot of the bulkhead freed up within its queue timeout"""
+
+
+class bulkhead:
+    """Lets at most limit calls run at once, the others wait in line
+    for up to queue_timeout seconds before being rejected"""
+
+    def __init__(self, name: str, limit: int = 16, queue_timeout: float = 2.0) -> None:
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def __enter__(self):
+        started = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        waited = time.monotonic() - started
+        with self._lock:
+            self.waiting -= 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            if not acquired:
+                self.rejected += 1
+                raise BulkheadFull(f"{self.name} has no free slot after {waited:.2f}s")
+            self.calls += 1
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = self.calls + self.rejected
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'calls': self.calls,
+                'rejected': self.rejected,
+                'avg_wait': round(self.wait_total / queued, 4) if queued else 0.0,
+                'max_wait': round(self.wait_max, 4),
+            }
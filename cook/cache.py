@@ -0,0 +1,102 @@
+"""In-process caches for the provider responses"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+
+
+class ttlCache:
+    """Bounded LRU cache whose entries go stale ttl seconds after being stored.
+
+    A stale entry is still served, while a single background refresh
+    reloads it through the given executor, until it is max_stale seconds
+    old (4 ttl by default). Past that it is dropped and looked up again,
+    so an old price isn't served on while the refreshes keep failing."""
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 30.0, executor: Executor = None,
+                 max_stale: float = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_stale = max_stale if max_stale is not None else 4 * ttl
+        self.executor = executor
+        self._data = OrderedDict()  # key -> (value, stored_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.refreshes = 0
+        self.failed_refreshes = 0
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def lookup(self, key, refresh=None):
+        """Returns (found, value) for the key.
+
+        When the entry is stale and refresh is given, refresh() is run in the
+        background and its result replaces the entry, unless it is None."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age >= self.max_stale:
+                del self._data[key]
+                self.expired += 1
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            if age < self.ttl:
+                self.hits += 1
+                return True, value
+            self.stale_hits += 1
+            if refresh is None or key in self._refreshing:
+                return True, value
+            self._refreshing.add(key)
+        self._refresh(key, refresh)
+        return True, value
+
+    def _refresh(self, key, refresh):
+        def reload():
+            value = None
+            try:
+                value = refresh()
+            except Exception:
+                pass
+            if value is not None:
+                self.put(key, value)
+            with self._lock:
+                self._refreshing.discard(key)
+                if value is None:
+                    self.failed_refreshes += 1
+                else:
+                    self.refreshes += 1
+
+        if self.executor is None:
+            threading.Thread(target=reload, daemon=True).start()
+        else:
+            self.executor.submit(reload)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'refreshes': self.refreshes,
+                'failed_refreshes': self.failed_refreshes,
+            }
@@ -0,0 +1,97 @@
+"""Whole-country price catalogue, prefetched from every server in the background"""
+import threading
+import time
+
+from .models import offers
+from telegram.bot import logger
+
+# Key of each server's service code in the menu
+MENU_KEYS = {
+    'Fast': 'fastCode',
+    'Tiger': 'tigerCode',
+    'Bower': 'bowerCode',
+    '5Sim': 'fiveCode',
+}
+
+
+class priceCatalogue:
+    """Keeps the full price table of each server in memory, indexed by
+    service name, and reloads it every interval seconds.
+
+    A server's table is only used while it is younger than max_age, so a
+    server whose bulk endpoint keeps failing falls back to the live lookup."""
+
+    def __init__(self, servers: dict, menu: dict, interval: float = 60.0, max_age: float = 120.0) -> None:
+        self.servers = servers
+        self.menu = menu
+        self.interval = interval
+        self.max_age = max_age
+        self.index: dict[str, dict[str, list[offers]]] = {}  # server name -> service name -> offers
+        self.loaded_at: dict[str, float] = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def build_index(self, serverName: str, table: dict[str, list[offers]]) -> dict[str, list[offers]]:
+        """Maps the service codes of a server's price table to the service names of the menu"""
+        key = MENU_KEYS[serverName]
+        index = {}
+        for name, codes in self.menu.items():
+            code = codes.get(key)
+            if code:
+                index[name] = table.get(code, [])
+        return index
+
+    def refresh(self):
+        """Downloads the price table of every server once"""
+        for serverName, server in self.servers.items():
+            try:
+                # Shares the server's bulkhead with the calls of the users
+                with server.slots:
+                    table = server.get_price_table()
+            except Exception:
+                table = None
+            if not isinstance(table, dict):
+                logger.warning(f"Price catalogue of {serverName} could not be loaded")
+                continue
+            index = self.build_index(serverName, table)
+            with self._lock:
+                self.index[serverName] = index
+                self.loaded_at[serverName] = time.monotonic()
+
+    def offers_for(self, serviceName: str, serverName: str):
+        """Returns the offers of the server for the service,
+        or None when the server's table is missing or too old"""
+        with self._lock:
+            loaded_at = self.loaded_at.get(serverName)
+            if loaded_at is None or time.monotonic() - loaded_at > self.max_age:
+                return None
+            return self.index[serverName].get(serviceName, [])
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Starts the background loader, if it is not running yet"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='price-catalogue', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                serverName: {
+                    'services': len(self.index[serverName]),
+                    'age': round(now - loaded_at, 1),
+                }
+                for serverName, loaded_at in self.loaded_at.items()
+            }
@@ -1,13 +1,46 @@
 from abc import abstractmethod, ABC
+import contextvars
+from contextlib import nullcontext
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from .models import (offers, phone_detail, serviceInfo, SERVERS, priceResponse, countryInfo)
 from .tools import (commonTools, BASE_URL, TOKENS,)
+from .cache import ttlCache
+from .catalogue import priceCatalogue
+from .breaker import health
+from .bulkhead import bulkhead, BulkheadFull
+from .transport import http
 from telegram.bot import logger
+from secrets_handler import get_setting
 
 tools = commonTools()
 
+# Overall time allowed for the providers to answer a price lookup
+PRICE_DEADLINE = get_setting('PRICE_DEADLINE', 4.0)
+price_workers = ThreadPoolExecutor(max_workers=get_setting('PRICE_WORKERS', 16),
+                                   thread_name_prefix='price')
+# Offers of each server for a service, keyed by (service name, server name)
+price_cache = ttlCache(maxsize=get_setting('PRICE_CACHE_SIZE', 4096),
+                       ttl=get_setting('PRICE_CACHE_TTL', 30.0),
+                       max_stale=get_setting('PRICE_CACHE_MAX_STALE', 120.0),
+                       executor=price_workers)
+status_workers = ThreadPoolExecutor(max_workers=get_setting('STATUS_WORKERS', 8),
+                                    thread_name_prefix='status')
+# Calls allowed to run at once at each server, and how long the others may wait for a slot
+PROVIDER_CONCURRENCY = get_setting('PROVIDER_CONCURRENCY', 16)
+PROVIDER_QUEUE_TIMEOUT = get_setting('PROVIDER_QUEUE_TIMEOUT', 2.0)
+PRICE_CATALOGUE = get_setting('PRICE_CATALOGUE', True)
+PRICE_CATALOGUE_INTERVAL = get_setting('PRICE_CATALOGUE_INTERVAL', 60.0)
+# Oldest catalogue prices quoted, the same bound as the price cache's
+PRICE_CATALOGUE_MAX_AGE = get_setting('PRICE_CATALOGUE_MAX_AGE', 120.0)
+
 
 class server(ABC):
+    # The bulkhead of the server, set by api_requests, for the calls
+    # the server makes on its own, outside api_requests.call
+    slots = nullcontext()
+
     @abstractmethod
     def get_phone_number(self, service_code: str, provider: str = 'Any') -> phone_detail:
         """Fetches phone number for the service code and optional provider.
@@ -35,6 +68,15 @@ class server(ABC):
         """
         pass
 
+    @abstractmethod
+    def get_price_table(self) -> dict[str, list[offers]]:
+        """Fetches the prices of every service of the country in one request.
+
+        Returns:
+            table (dict) : The offers for each service code, None if the request failed
+        """
+        pass
+
     @abstractmethod
     def get_balance(self) -> float:
         """Fetches the current balance in the server"""
@@ -56,6 +98,17 @@ class server(ABC):
         """
         pass
 
+    def check_otp_batch(self, access_ids: list[str]) -> dict[str, str]:
+        """Checks the OTP status of many access IDs together.
+
+        Servers with a bulk endpoint override this, otherwise every access ID is
+        checked on its own, a few at a time.
+
+        Returns:
+            dict: The check_otp answer for each access ID
+        """
+        return check_one_by_one(self, access_ids)
+
     @abstractmethod
     def cancel(self, access_id):
         """Tries to cancel the service,
@@ -66,13 +119,49 @@ class server(ABC):
         pass
 
 
+def check_one_by_one(server: server, access_ids: list[str]) -> dict[str, str]:
+    """Checks the access IDs with single check_otp calls, in parallel on the status
+    workers, each in the server's bulkhead, None for the ones refused a slot"""
+    def check(access_id):
+        try:
+            with server.slots:
+                return server.check_otp(access_id)
+        except BulkheadFull as b:
+            logger.warning(str(b))
+    return dict(zip(access_ids, status_workers.map(check, access_ids)))
+
+
+def active_activations(server: server, url: str, params: dict, access_ids: list[str]) -> dict[str, str]:
+    """Bulk status check for the SMS-Activate compatible servers, through getActiveActivations.
+
+    Activations missing from the answer are not active anymore,
+    so their final state is checked one by one."""
+    params = dict(params)
+    params['action'] = 'getActiveActivations'
+    with server.slots:
+        response = tools.getJson(url, params=params)
+    statuses = {}
+    try:
+        for activation in response['activeActivations']:
+            code = activation.get('smsCode')
+            if isinstance(code, list):
+                code = code[-1] if code else None
+            statuses[str(activation['activationId'])] = code if code else 'waiting'
+    except (KeyError, TypeError):
+        pass
+    missing = [access_id for access_id in access_ids if access_id not in statuses]
+    if missing:
+        statuses.update(check_one_by_one(server, missing))
+    return {access_id: statuses[access_id] for access_id in access_ids}
+
+
 class FastSMS(server):
     def __init__(self, countryID: int = 22) -> None:
         self.url = BASE_URL['fast']
-        self.main_params = {"api_key": TOKENS["fast"], "country": countryID}
+        self.main_params = MappingProxyType({"api_key": TOKENS["fast"], "country": countryID})
 
     def get_phone_number(self, service_code, provider='Any'):
-        params = self.main_params
+        params = dict(self.main_params)
         params['service'] = service_code
         params['action'] = "getNumber"
         params['country'] = 22
@@ -84,11 +173,11 @@ class FastSMS(server):
             pass
 
     def get_prices(self, service_code):
-        params = self.main_params
+        params = dict(self.main_params)
         params['action'] = "getPrices"
         params['service'] = service_code
         params['country'] = 22
-        response = tools.getJson(BASE_URL['fast'], params=params)
+        response = tools.getJson(self.url, params=params)
         try:
             price = list(response['22'][service_code].keys())[0]
             count = list(response['22'][service_code].values())[0]
@@ -96,8 +185,24 @@ class FastSMS(server):
         except:
             pass
 
+    def get_price_table(self):
+        params = dict(self.main_params)
+        params['action'] = "getPrices"
+        params['country'] = 22
+        response = tools.getJson(self.url, params=params)
+        if tools.isError(response):
+            return None
+        try:
+            table = {}
+            for code, prices in response['22'].items():
+                price, count = list(prices.items())[0]
+                table[code] = [offers('Fast', count=count, cost=price)]
+            return table
+        except:
+            pass
+
     def check_otp(self, access_id: str) -> str:
-        params = self.main_params
+        params = dict(self.main_params)
         params['id'] = access_id
         params['action'] = "getStatus"
         response = tools.getText(self.url, params=params)
@@ -109,8 +214,11 @@ class FastSMS(server):
             elif "OK" in response:
                 return response.split(":")[-1]
 
+    def check_otp_batch(self, access_ids: list[str]) -> dict[str, str]:
+        return active_activations(self, self.url, self.main_params, access_ids)
+
     def cancel(self, access_id):
-        params = self.main_params
+        params = dict(self.main_params)
         params['id'] = access_id
         params['status'] = 8
         params['action'] = 'setStatus'
@@ -118,8 +226,9 @@ class FastSMS(server):
         return response == 'ACCESS_CANCEL'
 
     def get_balance(self) -> float:
-        self.main_params['action'] = "getBalance"
-        resp = tools.getText(self.url, params=self.main_params)
+        params = dict(self.main_params)
+        params['action'] = "getBalance"
+        resp = tools.getText(self.url, params=params)
         try:
             bal = float(resp.split(":")[-1])
             return bal
@@ -130,10 +239,10 @@ class FastSMS(server):
 class tigersms(server):
     def __init__(self) -> None:
         self.url = "https://api.tiger-sms.com/stubs/handler_api.php"
-        self.params = {"api_key": TOKENS['tiger']}
+        self.params = MappingProxyType({"api_key": TOKENS['tiger']})
 
     def get_balance(self) -> float:
-        params = self.params
+        params = dict(self.params)
         params['action'] = 'getBalance'
         resp = tools.getText(self.url, params=params)
         try:
@@ -143,22 +252,35 @@ class tigersms(server):
             pass
 
     def get_prices(self, service_code):
-        base_url = "https://api.tiger-sms.com/stubs/handler_api.php"
         serviceid = service_code
         countrycode = '22'
-        params = self.params
+        params = dict(self.params)
         params['action'] = "getPrices"
         params['service'] = serviceid
         params['country'] = countrycode
-        response = tools.getJson(base_url, params=params)
+        response = tools.getJson(self.url, params=params)
         try:
             data = response[countrycode][serviceid]
             return [offers('Tiger', cost=data['cost'], count=data['count'])]
         except:
             pass
 
+    def get_price_table(self):
+        countrycode = '22'
+        params = dict(self.params)
+        params['action'] = "getPrices"
+        params['country'] = countrycode
+        response = tools.getJson(self.url, params=params)
+        if tools.isError(response):
+            return None
+        try:
+            return {code: [offers('Tiger', cost=data['cost'], count=data['count'])]
+                    for code, data in response[countrycode].items()}
+        except:
+            pass
+
     def get_phone_number(self, service_code: str, provider: str = 'Any'):
-        params = self.params
+        params = dict(self.params)
         params['service'] = service_code
         params['action'] = "getNumber"
         params['country'] = '22'
@@ -183,7 +305,7 @@ class tigersms(server):
           BAD_ACTION - incorrect action
           NO_ACTIVATION - incorrect activation id
         """
-        params = self.params
+        params = dict(self.params)
         params['id'] = access_id
         params['action'] = "getStatus"
         response = tools.getText(self.url, params=params)
@@ -195,6 +317,9 @@ class tigersms(server):
             elif "OK" in response:
                 return response.split(":")[-1]
 
+    def check_otp_batch(self, access_ids: list[str]) -> dict[str, str]:
+        return active_activations(self, self.url, self.params, access_ids)
+
     def cancel(self, access_id):
         """
         Change the status of the given access ID,
@@ -224,7 +349,7 @@ class tigersms(server):
         BAD_ACTION - incorrect action
         """
 
-        params = self.params
+        params = dict(self.params)
         params['id'] = access_id
         params['status'] = str(8)
         params['action'] = 'setStatus'
@@ -237,10 +362,10 @@ class tigersms(server):
 class bowersms(server):
     def __init__(self):
         self.url = "https://smsbower.com/stubs/handler_api.php"
-        self.params = {"api_key": TOKENS['bower']}
+        self.params = MappingProxyType({"api_key": TOKENS['bower']})
 
     def get_balance(self) -> float:
-        params = self.params
+        params = dict(self.params)
         params["action"] = "getBalance"
         resp = tools.getText(self.url, params=params)
         try:
@@ -250,7 +375,7 @@ class bowersms(server):
             pass
 
     def get_prices(self, service_code):
-        params = self.params
+        params = dict(self.params)
         serviceCode = service_code
         countryCode = '22'
         params['action'] = "getPrices"
@@ -265,8 +390,22 @@ class bowersms(server):
         except:
             pass
 
+    def get_price_table(self):
+        countryCode = '22'
+        params = dict(self.params)
+        params['action'] = "getPrices"
+        params['country'] = countryCode
+        response = tools.getJson(self.url, params=params)
+        if tools.isError(response):
+            return None
+        try:
+            return {code: [offers('Bower', count=data['count'], cost=data['cost'])]
+                    for code, data in response[countryCode].items()}
+        except:
+            pass
+
     def get_phone_number(self, service_code: str, provider: str = 'Any'):
-        params = self.params
+        params = dict(self.params)
         params['service'] = service_code
         params['action'] = "getNumber"
         params['country'] = '22'
@@ -291,7 +430,7 @@ class bowersms(server):
           BAD_ACTION - incorrect action
           NO_ACTIVATION - incorrect activation id
         """
-        params = self.params
+        params = dict(self.params)
         params['id'] = access_id
         params['action'] = "getStatus"
         response = tools.getText(self.url, params=params)
@@ -304,6 +443,9 @@ class bowersms(server):
             elif "OK" in response:
                 return response.split(":")[-1]
 
+    def check_otp_batch(self, access_ids: list[str]) -> dict[str, str]:
+        return active_activations(self, self.url, self.params, access_ids)
+
     def cancel(self, access_id):
         """Change the status of the given access ID,
           activation status code 
@@ -328,7 +470,7 @@ class bowersms(server):
 
           """
 
-        params = self.params
+        params = dict(self.params)
         params['id'] = access_id
         params['status'] = str(8)
         params['action'] = "setSatus"
@@ -346,10 +488,11 @@ class fivesimsms(server):
             'Accept': 'application/json',
         }
 
+        self.url = 'https://5sim.net/v1'
         self.country = 'india'
 
     def get_balance(self) -> float:
-        url = 'https://5sim.net/v1/user/profile'
+        url = self.url + '/user/profile'
         response = tools.getJson(url,
                                  headers=self.headers)
         try:
@@ -368,7 +511,7 @@ class fivesimsms(server):
             'country': countryCode
         }
 
-        response = tools.getJson('https://5sim.net/v1/guest/prices',
+        response = tools.getJson(self.url + '/guest/prices',
                                  headers=self.headers,
                                  params=params)
         try:
@@ -382,11 +525,27 @@ class fivesimsms(server):
         except Exception:
             pass
 
+    def get_price_table(self):
+        countryCode = 'india'
+        response = tools.getJson(self.url + '/guest/prices',
+                                 headers=self.headers,
+                                 params={'country': countryCode})
+        if tools.isError(response):
+            return None
+        try:
+            table = {}
+            for product, operators in response[countryCode].items():
+                table[product] = [offers('5Sim', key, val['count'], val['cost'])
+                                  for key, val in operators.items() if val['count'] != 0]
+            return table
+        except Exception:
+            pass
+
     def get_phone_number(self, service_code: str, provider: str = 'Any') -> phone_detail:
         country = self.country
         product = service_code
         operator = provider
-        url = f"https://5sim.net/v1/user/buy/activation/{country}/{operator}/{product}"
+        url = f"{self.url}/user/buy/activation/{country}/{operator}/{product}"
         response = tools.getJson(url,
                                  headers=self.headers)
         try:
@@ -406,28 +565,58 @@ class fivesimsms(server):
         BANNED - Number banned, when number already used
         """
 
-        url = 'https://5sim.net/v1/user/check/' + access_id
+        url = self.url + '/user/check/' + access_id
         response = tools.getJson(url,
                                  headers=self.headers)
         if tools.isError(response):
             return 'Invalid'
         else:
-            try:
-                # Returning the last OTP Received
-                if "PENDING" in response['status']:
+            return self.order_status(response)
+
+    @staticmethod
+    def order_status(order: dict) -> str:
+        try:
+            # Returning the last OTP Received
+            if "PENDING" in order['status']:
+                return 'waiting'
+            elif order['status'] in ['CANCELED', 'TIMEOUT', 'BANNED']:
+                return 'canceled'
+            elif order['status'] in ['RECEIVED', 'FINISHED']:
+                if order['sms']:
+                    return order['sms'][-1]['code']
+                else:
                     return 'waiting'
-                elif response['status'] in ['CANCELED', 'TIMEOUT', 'BANNED']:
-                    return 'canceled'
-                elif response['status'] in ['RECEIVED', 'FINISHED']:
-                    if response['sms']:
-                        return response['sms'][-1]['code']
-                    else:
-                        return 'waiting'
-            except:
+        except:
+            pass
+
+    def check_otp_batch(self, access_ids: list[str]) -> dict[str, str]:
+        """Reads the statuses from the latest orders in one request,
+        the access IDs not among them are checked one by one"""
+        url = self.url + '/user/orders'
+        params = {
+            'category': 'activation',
+            'limit': max(50, 2 * len(access_ids)),
+            'order': 'id',
+            'reverse': 'true',
+        }
+        with self.slots:
+            response = tools.getJson(url,
+                                     headers=self.headers,
+                                     params=params)
+        statuses = {}
+        if not tools.isError(response):
+            try:
+                for order in response['Data']:
+                    statuses[str(order['id'])] = self.order_status(order)
+            except (KeyError, TypeError):
                 pass
+        missing = [access_id for access_id in access_ids if statuses.get(access_id) is None]
+        if missing:
+            statuses.update(check_one_by_one(self, missing))
+        return {access_id: statuses[access_id] for access_id in access_ids}
 
     def cancel(self, access_id):
-        url = f'https://5sim.net/v1/user/cancel/' + str(access_id)
+        url = self.url + '/user/cancel/' + str(access_id)
         response = tools.getJson(url,
                                  headers=self.headers)
         if tools.isError(response):
@@ -450,55 +639,129 @@ class api_requests():
             "Bower": self.bower,
             "5Sim": self.five
         }
+        self.breakers = {serverName: health.for_host(http.host_of(server.url))
+                         for serverName, server in self.server.items()}
+        self.bulkheads = {
+            serverName: bulkhead(serverName,
+                                 limit=get_setting(f'PROVIDER_CONCURRENCY_{serverName.upper()}', PROVIDER_CONCURRENCY),
+                                 queue_timeout=PROVIDER_QUEUE_TIMEOUT)
+            for serverName in self.server
+        }
+        for serverName, server in self.server.items():
+            server.slots = self.bulkheads[serverName]
+        self.catalogue = priceCatalogue(self.server, tools.serviceMenu,
+                                        interval=PRICE_CATALOGUE_INTERVAL,
+                                        max_age=PRICE_CATALOGUE_MAX_AGE)
+        if PRICE_CATALOGUE:
+            self.catalogue.start()
+
+    def available(self, serverName: SERVERS) -> bool:
+        """False while the server's circuit breaker is open, call it right
+        before a call to the server, it takes the half-open probe"""
+        return self.breakers[serverName].allow()
+
+    def is_open(self, serverName: SERVERS) -> bool:
+        """Whether the server's circuit breaker refuses calls, without taking the probe"""
+        return self.breakers[serverName].is_open()
+
+    def health_report(self) -> dict:
+        return {serverName: breaker.snapshot() for serverName, breaker in self.breakers.items()}
+
+    def bulkhead_report(self) -> dict:
+        return {serverName: slots.stats() for serverName, slots in self.bulkheads.items()}
+
+    def call(self, serverName: SERVERS, method: str, *args):
+        """Runs the server's method inside the server's bulkhead,
+        raises BulkheadFull when no slot frees up in time"""
+        with self.bulkheads[serverName]:
+            return getattr(self.server[serverName], method)(*args)
 
     def get_balance(self, serverName: SERVERS):
-        server = self.server[serverName]
-        bal = server.get_balance()
+        try:
+            bal = self.call(serverName, 'get_balance')
+        except BulkheadFull as b:
+            logger.warning(str(b))
+            bal = None
         if not isinstance(bal,float):
             bal = -9.99
             logger.error(f"Failed to fetch server balance at {serverName}")
         return {serverName: bal}
 
-    def getPricesFromName(self, serviceName: str):
+    def getPricesFromName(self, serviceName: str, deadline: float = PRICE_DEADLINE):
+        """Reads the prices from the price catalogue, and looks up the servers missing
+        from it concurrently, servers which do not answer within the deadline are left out"""
         service_info = tools.getServiceInfo(serviceName, country=countryInfo())
         if service_info is None:
             return "Service not found"
 
         lis = []
-        error_price = lambda server: logger.error(f"Error in getting price from {server} for {service_info.name}")
-        if service_info.bowerCode:
+        lookups = {}
+        for serverName in ['Bower', 'Tiger', 'Fast', '5Sim']:
+            code = self.get_service_code(serverName, service_info)
+            if not code:
+                continue
+            if self.is_open(serverName):
+                logger.info(f"{serverName} is skipped for {service_info.name}, its circuit is open")
+                continue
+            listed = self.catalogue.offers_for(service_info.name, serverName)
+            if listed is not None:
+                lis += listed
+                continue
+            fetch = lambda serverName=serverName, code=code: self.call(serverName, 'get_prices', code)
+            found, cached = price_cache.lookup((service_info.name, serverName), refresh=fetch)
+            if found:
+                lis += cached
+            elif self.available(serverName):
+                # The lookup runs on the update's budget
+                lookups[serverName] = price_workers.submit(contextvars.copy_context().run, fetch)
+                lookups[serverName].add_done_callback(
+                    lambda lookup, key=(service_info.name, serverName): self._cache_prices(key, lookup))
+        _, late = wait(lookups.values(), timeout=deadline)
+
+        for serverName, lookup in lookups.items():
+            if lookup in late:
+                logger.warning(f"{serverName} missed the {deadline}s price deadline for {service_info.name}")
+                continue
             try:
-                lis += self.bower.get_prices(service_info.bowerCode)
+                lis += lookup.result()
+            except BulkheadFull as b:
+                logger.warning(f"{b}, no price for {service_info.name}")
             except:
-                error_price('Bower')
-        if service_info.tigerCode:
-            try:
-                lis += self.tiger.get_prices(service_info.tigerCode)
-            except:
-                error_price('Tiger')
-        if service_info.fastCode:
-            try:
-                lis += self.fast.get_prices(service_info.fastCode)
-            except:
-                error_price('Fast')
-        if service_info.fiveCode:
-            try:
-                lis += self.five.get_prices(service_info.fiveCode)
-            except:
-                error_price('5Sim')
+                logger.error(f"Error in getting price from {serverName} for {service_info.name}")
         return priceResponse(service=service_info, offers=lis)
 
+    @staticmethod
+    def _cache_prices(key, lookup):
+        """Stores the offers of a finished price lookup, even one that missed the deadline"""
+        if lookup.exception() is None and lookup.result() is not None:
+            price_cache.put(key, lookup.result())
+
     def getPhoneFromName(self, server_name: SERVERS,
                          serviceName: str = None,
                          provider: str = 'Any') -> phone_detail:
         serviceinfo = tools.getServiceInfo(serviceName, countryInfo())
-        return self.server[server_name].get_phone_number(self.get_service_code(server_name, serviceinfo), provider)
+        if not self.available(server_name):
+            logger.warning(f"Not buying {serviceName} at {server_name}, its circuit is open")
+            return None
+        return self.call(server_name, 'get_phone_number', self.get_service_code(server_name, serviceinfo), provider)
 
     def get_otp(self, server_name: SERVERS,
                 access_id: str,
                 ) -> str:
-        server = self.server[server_name]
-        return server.check_otp(access_id)
+        try:
+            return self.call(server_name, 'check_otp', access_id)
+        except BulkheadFull as b:
+            logger.warning(str(b))
+
+    def get_otp_batch(self, server_name: SERVERS,
+                      access_ids: list[str],
+                      ) -> dict[str, str]:
+        try:
+            # Not through call, the batch takes a slot for each request it sends
+            return self.server[server_name].check_otp_batch(access_ids)
+        except BulkheadFull as b:
+            logger.warning(str(b))
+            return {}
 
     def get_service_code(self, server_name: SERVERS, service_info: serviceInfo):
         if server_name == '5Sim': return service_info.fiveCode
@@ -507,8 +770,11 @@ class api_requests():
         if server_name == 'Tiger': return service_info.tigerCode
 
     def cancelPhone(self, serverName: SERVERS, access_id: str):
-        server = self.server[serverName]
-        return server.cancel(access_id)  # server.cancelService(access_id)
+        try:
+            return self.call(serverName, 'cancel', access_id)
+        except BulkheadFull as b:
+            logger.warning(str(b))
+            return False
 
 
 def manualtest():
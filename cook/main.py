@@ -1,10 +1,13 @@
 import io
 from logging import log
 
-from .helper import api_requests
+from .helper import api_requests, price_cache
+from .transport import http
 from .models import SERVERS, phone_detail
+from startup import lazy
 
-req = api_requests()
+# The provider clients, built on first use, which also starts the price catalogue
+req = lazy('cook.req', api_requests)
 
 
 def get_price_from_name(servicename: str):
@@ -42,6 +45,19 @@ def get_updates(server: SERVERS,
     return resp
 
 
+def get_updates_batch(server: SERVERS,
+                      access_ids: list[str]):
+    """Get the otp updates for many phone numbers of the same server"""
+
+    resp = req.get_otp_batch(server_name=server,
+                             access_ids=access_ids)
+    for access_id, update in resp.items():
+        if not isinstance(update, str):
+            log(2, f'Error getting update for the {server, access_id}')
+            resp[access_id] = 'Error getting update'
+    return resp
+
+
 def cancel_phone(server: SERVERS, access_id: str):
     """Cancel the otp update for a given phone number details,
 
@@ -57,6 +73,20 @@ def get_all_balance():
         resp[i] = req.get_balance(i)[i]
     return resp
 
+def get_health():
+    """Returns the circuit state and health score of each server"""
+    return req.health_report()
+
+def get_stats():
+    """Returns the counters of the provider calls"""
+    return {
+        'http': http.stats(),
+        'price_cache': price_cache.stats(),
+        'price_catalogue': req.catalogue.stats(),
+        'health': req.health_report(),
+        'bulkheads': req.bulkhead_report(),
+    }
+
 def manual_test():
     name = 'Telegram'
     server_name = 'Tiger'
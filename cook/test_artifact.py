@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from .artifact import build, catalogueArtifact, ArtifactError, service_code
+
+
+@pytest.fixture
+def menu_files(tmp_path):
+    names = ['Telegram', '1хbet', 'Amazon', 'Zédelivery', 'Paytm']
+    menu_txt = tmp_path / 'menu.txt'
+    menu_txt.write_text('\n'.join(names) + '\n', encoding='utf-8')
+    menu = {name: {'fastCode': name[:2].lower()} for name in names}
+    menu_json = tmp_path / 'menuList.json'
+    menu_json.write_text(json.dumps(menu), encoding='utf-8')
+    return names, menu, str(menu_txt), str(menu_json), str(tmp_path / 'catalogue.bin')
+
+
+def test_artifact_round_trip(menu_files):
+    names, menu, menu_txt, menu_json, out = menu_files
+    artifact = catalogueArtifact(build(menu_txt, menu_json, out))
+    database = {service_code(name): name for name in names}
+    assert list(artifact.database.items()) == list(database.items())
+    for code, name in database.items():
+        assert code in artifact.database and artifact.database[code] == name
+    assert 'missing' not in artifact.database
+    assert dict(artifact.menu.items()) == menu
+    assert artifact.menu['1хbet'] == {'fastCode': '1х'}
+    with pytest.raises(KeyError):
+        artifact.menu['Unknown']
+
+
+def test_other_versions_are_refused(menu_files):
+    *_, menu_txt, menu_json, out = menu_files
+    build(menu_txt, menu_json, out)
+    with open(out, 'r+b') as file:
+        file.seek(8)
+        file.write(b'\xff\xff')
+    with pytest.raises(ArtifactError):
+        catalogueArtifact(out)
+    with pytest.raises(ArtifactError):
+        catalogueArtifact(out + '.missing')
@@ -0,0 +1,40 @@
+import pytest
+from requests import Timeout
+
+import budget
+from . import breaker, transport
+from .breaker import circuitBreaker, healthRegistry
+from .transport import sessionPool
+
+
+def test_listing_check_leaves_the_probe_to_the_call(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(breaker.time, 'monotonic', lambda: now[0])
+    host = circuitBreaker(min_calls=2, cooldown=30)
+    host.record(False, 0.1)
+    host.record(False, 0.1)
+    assert host.is_open() and not host.allow()
+    now[0] += 31
+    # Listing the offers many times doesn't take the half-open probe
+    assert not any(host.is_open() for _ in range(5))
+    assert host.allow()
+    assert host.is_open() and not host.allow()
+    host.record(True, 0.1)
+    assert not host.is_open() and host.state == circuitBreaker.CLOSED
+
+
+def test_timeout_cut_by_the_budget_isnt_held_against_the_host(monkeypatch):
+    pool = sessionPool(connect_timeout=3, read_timeout=15)
+
+    def timing_out(url, params=None, headers=None, timeout=None):
+        raise Timeout(f"timed out after {timeout}")
+
+    monkeypatch.setattr(pool.session_for('https://slow.example'), 'get', timing_out)
+    monkeypatch.setattr(transport, 'health', healthRegistry())
+    with budget.begin(1.0):
+        with pytest.raises(Timeout):
+            pool.get('https://slow.example/prices')
+    assert transport.health.for_host('slow.example').snapshot()['calls'] == 0
+    with pytest.raises(Timeout):
+        pool.get('https://slow.example/prices')
+    assert transport.health.for_host('slow.example').snapshot()['calls'] == 1
@@ -0,0 +1,49 @@
+from concurrent.futures import Executor
+
+from . import cache
+from .cache import ttlCache
+
+
+class inline(Executor):
+    """Runs the refreshes right away, so the test needs no threads"""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+class clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_stale_entries_expire_when_refreshes_keep_failing(monkeypatch):
+    now = clock()
+    monkeypatch.setattr(cache.time, 'monotonic', now.monotonic)
+    prices = ttlCache(ttl=10, max_stale=40, executor=inline())
+    prices.put('Telegram', [12.5])
+
+    def failing():
+        raise ConnectionError("provider is down")
+
+    now.now += 5
+    assert prices.lookup('Telegram', refresh=failing) == (True, [12.5])
+    now.now += 20
+    # Stale, served while the refresh fails
+    assert prices.lookup('Telegram', refresh=failing) == (True, [12.5])
+    assert prices.lookup('Telegram', refresh=lambda: None) == (True, [12.5])
+    now.now += 20
+    assert prices.lookup('Telegram', refresh=failing) == (False, None)
+    stats = prices.stats()
+    assert stats['expired'] == 1 and stats['size'] == 0
+    assert stats['failed_refreshes'] == 2 and stats['refreshes'] == 0
+
+
+def test_refresh_resets_the_age():
+    prices = ttlCache(ttl=0, max_stale=60, executor=inline())
+    prices.put('Telegram', [12.5])
+    assert prices.lookup('Telegram', refresh=lambda: [13.0]) == (True, [12.5])
+    assert prices.lookup('Telegram') == (True, [13.0])
+    assert prices.stats()['refreshes'] == 1
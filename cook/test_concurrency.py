@@ -0,0 +1,139 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+
+from .bulkhead import bulkhead
+from .helper import FastSMS, tigersms, bowersms, fivesimsms, check_one_by_one
+from .tools import TOKENS
+
+# Parameters each action may carry, anything else leaked from another call
+ALLOWED = {
+    'getStatus': {'api_key', 'country', 'action', 'id'},
+    'getNumber': {'api_key', 'country', 'action', 'service', 'ref', 'maxPrice'},
+    'getPrices': {'api_key', 'country', 'action', 'service'},
+    'setStatus': {'api_key', 'country', 'action', 'id', 'status'},
+    'setSatus': {'api_key', 'country', 'action', 'id', 'status'},
+}
+KEYS = {'/fast': TOKENS['fast'], '/tiger': TOKENS['tiger'], '/bower': TOKENS['bower']}
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Answers like the providers, echoing the identifiers it received"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: value[0] for key, value in parse_qs(url.query).items()}
+        if url.path.startswith('/five/'):
+            body = self.five(url.path[len('/five'):], query)
+        else:
+            body = self.sms_activate(url.path, query)
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        data = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def sms_activate(path, query):
+        action = query.get('action')
+        if query.get('api_key') != KEYS.get(path) or set(query) - ALLOWED.get(action, set()):
+            return 'BAD_ACTION'
+        if action == 'getStatus':
+            return 'STATUS_OK:' + query['id']
+        if action == 'getNumber':
+            return f"ACCESS_NUMBER:{query['service']}:{query['service']}"
+        if action == 'getPrices':
+            cost = int(query['service'][1:])
+            if path == '/fast':
+                return {'22': {query['service']: {str(cost): 1}}}
+            return {'22': {query['service']: {'cost': cost, 'count': 1}}}
+        return 'ACCESS_CANCEL'
+
+    @staticmethod
+    def five(path, query):
+        if path.startswith('/user/check/'):
+            return {'status': 'RECEIVED', 'sms': [{'code': path.split('/')[-1]}]}
+        if path.startswith('/user/buy/activation/'):
+            product = path.split('/')[-1]
+            return {'phone': product, 'id': product}
+        if path == '/guest/prices':
+            return {'india': {query['product']: {'virtual': {'cost': int(query['product'][1:]), 'count': 1}}}}
+        return {}
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+@pytest.fixture(scope='module')
+def clients():
+    server = StandInServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    fast, tiger, bower, five = FastSMS(), tigersms(), bowersms(), fivesimsms()
+    fast.url, tiger.url, bower.url, five.url = base + '/fast', base + '/tiger', base + '/bower', base + '/five'
+    yield [fast, tiger, bower, five]
+    server.shutdown()
+
+
+def test_parallel_calls_do_not_cross_contaminate(clients):
+    rng = random.Random(22)
+    calls = []
+    for i in range(600):
+        client = rng.choice(clients)
+        operation = rng.choice(['check_otp', 'get_prices', 'get_phone_number'])
+        calls.append((client, operation, f's{i}'))
+
+    def run(call):
+        client, operation, arg = call
+        return getattr(client, operation)(arg)
+
+    with ThreadPoolExecutor(max_workers=200) as pool:
+        results = list(pool.map(run, calls))
+
+    for (client, operation, arg), result in zip(calls, results):
+        if operation == 'check_otp':
+            assert result == arg
+        elif operation == 'get_prices':
+            assert [offer.cost for offer in result] == [float(arg[1:])]
+        else:
+            assert (result.phone, result.access_id) == (arg, arg)
+
+
+class slowChecks:
+    """Counts the status checks running at once"""
+
+    def __init__(self, limit) -> None:
+        self.slots = bulkhead('slow', limit=limit, queue_timeout=5)
+        self.running = 0
+        self.most = 0
+        self._lock = threading.Lock()
+
+    def check_otp(self, access_id):
+        with self._lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+        time.sleep(0.02)
+        with self._lock:
+            self.running -= 1
+        return 'waiting'
+
+
+def test_one_by_one_checks_keep_to_the_bulkhead():
+    server = slowChecks(limit=2)
+    statuses = check_one_by_one(server, [str(i) for i in range(16)])
+    assert set(statuses.values()) == {'waiting'}
+    assert server.most <= 2 and server.slots.stats()['calls'] == 16
@@ -3,8 +3,10 @@ import json
 from os import getcwd,path
 from typing import Union
 
-from requests import get
+from requests import RequestException
 from .models import (serviceInfo, countryInfo, Error)
+from .transport import http
+from .artifact import shared
 from secrets_handler import VARIABLES
 
 # Variable Declaration
@@ -26,6 +28,10 @@ TOKENS = {
 
 class commonTools:
     def __init__(self) -> None:
+        artifact = shared()
+        if artifact is not None:
+            self.serviceMenu = artifact.menu
+            return
         module_dir = path.dirname(__file__)
         menu = "menuList.json"
         menu_path = path.join(module_dir, menu)
@@ -62,7 +68,10 @@ class commonTools:
         Returns the text of the response from the request if successfully,
         Otherwise Error(code)(response)
         """
-        resp = get(url, params=params, headers=headers)
+        try:
+            resp = http.get(url, params=params, headers=headers)
+        except RequestException as e:
+            return f"Error{type(e).__name__}: {e}"
         if resp.status_code == 200:
             return resp.text
         else:
@@ -73,7 +82,10 @@ class commonTools:
         """
         Return Json Object if successfully, else a {'Error':response.Text}
         """
-        resp = get(url, params=params, headers=headers)
+        try:
+            resp = http.get(url, params=params, headers=headers)
+        except RequestException as e:
+            return {"Error": f"{type(e).__name__}: {e}"}
 
         if resp.status_code == 200:
             if responsePrint:
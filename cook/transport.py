@@ -0,0 +1,108 @@
+"""Pooled keep-alive HTTP sessions for the provider APIs"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+from requests import Session, RequestException, Timeout
+from requests.adapters import HTTPAdapter
+
+from secrets_handler import get_setting
+from .breaker import health
+import budget
+
+POOL_SIZE = get_setting('HTTP_POOL_SIZE', 10)
+CONNECT_TIMEOUT = get_setting('HTTP_CONNECT_TIMEOUT', 3.05)
+READ_TIMEOUT = get_setting('HTTP_READ_TIMEOUT', 15.0)
+
+
+class sessionPool:
+    """Keeps one keep-alive session per provider host, so repeated calls
+    to the same provider reuse the open TCP+TLS connections"""
+
+    def __init__(self, pool_size: int = POOL_SIZE,
+                 connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT) -> None:
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self._sessions: dict[str, Session] = {}
+        self._requests: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlsplit(url).netloc
+
+    def session_for(self, url: str) -> Session:
+        """Returns the session of the url's host, creating it on first use"""
+        host = self.host_of(url)
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = Session()
+                    adapter = HTTPAdapter(pool_connections=1,
+                                          pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._sessions[host] = session
+                    self._requests[host] = 0
+        return session
+
+    def get(self, url: str, params=None, headers=None, timeout=None):
+        """Sends a GET on the pooled session of the host, recording its outcome in the host's health.
+
+        The timeout is capped to what is left of the update's budget, a
+        timeout cut short that way isn't held against the host.
+        Raises requests.RequestException on connection errors and timeouts,
+        and budget.BudgetExhausted when the update has no time left"""
+        host = self.host_of(url)
+        session = self.session_for(url)
+        wanted = timeout or self.timeout
+        timeout = budget.timeout(wanted)
+        with self._lock:
+            self._requests[host] += 1
+        started = time.monotonic()
+        try:
+            with budget.stage('cook'):
+                resp = session.get(url, params=params, headers=headers,
+                                   timeout=timeout)
+        except Timeout:
+            if timeout == wanted:
+                health.record(host, False, time.monotonic() - started)
+            raise
+        except RequestException:
+            health.record(host, False, time.monotonic() - started)
+            raise
+        ok = resp.status_code < 500 and resp.status_code != 429
+        health.record(host, ok, time.monotonic() - started)
+        return resp
+
+    def stats(self) -> dict:
+        """Returns per host counters of requests, new connections (handshakes)
+        and requests served over an already open connection"""
+        report = {}
+        for host, session in list(self._sessions.items()):
+            handshakes = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is not None:
+                        handshakes += pool.num_connections
+            sent = self._requests.get(host, 0)
+            report[host] = {
+                'requests': sent,
+                'handshakes': handshakes,
+                'reused': max(sent - handshakes, 0),
+            }
+        return report
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+http = sessionPool()
@@ -1,7 +1,10 @@
 import datetime
 from requests import get
 from .main import reception_api
-from secrets_handler import VARIABLES
+from secrets_handler import VARIABLES, get_setting
+import budget
+
+BANK_TIMEOUT = (get_setting('BANK_CONNECT_TIMEOUT', 3.05), get_setting('BANK_READ_TIMEOUT', 10.0))
 
 
 # Todo : Add Admin feature to change the QR Code and the credentials
@@ -16,7 +19,9 @@ def check_amount_received(utr_no
     start_date = previous_datetime.timestamp()
     url = f"https://payments-tesseract.bharatpe.in/api/v1/merchant/transactions?module=PAYMENT_QR&merchantId={merchantid}&sDate={start_date}&eDate={end_date}"
     headers = {"Token": pay_token}
-    response = get(url, headers=headers)
+    timeout = budget.timeout(BANK_TIMEOUT)
+    with budget.stage('reception'):
+        response = get(url, headers=headers, timeout=timeout)
     if response.status_code == 200:
         data = response.json()
         transactions = data['data']['transactions']
@@ -1,6 +1,9 @@
 from logging import log
+from collections import OrderedDict
 import datetime
+import itertools
 import os
+import threading
 
 from sqlalchemy import (
     create_engine,
@@ -9,11 +12,15 @@ from sqlalchemy import (
     Float,
     Date,
     Text,
+    Boolean,
     TIMESTAMP,
     ForeignKey,
+    UniqueConstraint,
     func
 )
 
+from startup import lazy
+from secrets_handler import get_setting
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.exc import IntegrityError
 
@@ -45,11 +52,61 @@ class Recharges(Base):
     userid = Column(BigInteger, ForeignKey("user_info.userid"))
 
 
+# Activation status
+WAITING = 'waiting'
+RECEIVED = 'received'
+CANCELED = 'canceled'
+
+
+class Activation(Base):
+    """A number issued to a user, its buttons carry only the activation_id"""
+    __tablename__ = "activations"
+    __table_args__ = (UniqueConstraint("server", "access_id"),)
+
+    activation_id = Column(Integer, primary_key=True)
+    userid = Column(BigInteger, ForeignKey("user_info.userid"))
+    server = Column(Text)
+    access_id = Column(Text)
+    phone = Column(Text)
+    service_name = Column(Text)
+    price = Column(Float)
+    provider = Column(Text)
+    status = Column(Text, default=WAITING)
+    refunded = Column(Boolean, default=False)
+    # Issued before activations were stored, its price and refund are unknown
+    adopted = Column(Boolean, default=False)
+    created = Column(TIMESTAMP, default=datetime.datetime.now)
+
+    def to_dict(self):
+        return {
+            'id': self.activation_id,
+            'user_id': self.userid,
+            'server': self.server,
+            'access_id': self.access_id,
+            'phone': self.phone,
+            'service_name': self.service_name,
+            'price': self.price,
+            'provider': self.provider,
+            'status': self.status,
+            'refunded': self.refunded,
+            'adopted': self.adopted,
+        }
+
+
+class ProcessedUpdate(Base):
+    """Telegram updates claimed by a worker, to drop their redeliveries"""
+    __tablename__ = "processed_updates"
+
+    update_id = Column(BigInteger, primary_key=True)
+    received = Column(TIMESTAMP, default=datetime.datetime.now)
+
+
 class UserDatabase:
     def __init__(self, connection_string):
         self.engine = create_engine(connection_string)
         Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
+        self._claims = itertools.count(1)
 
     def add_user(self, userid):
         with self.Session() as session:
@@ -124,6 +181,71 @@ class UserDatabase:
                 log(2, "Recharge Recording Issue")
                 raise e
 
+    def add_activation(self, user_id, server, access_id, phone, service_name, price, provider, adopted=False):
+        """Records the issued number with its price as the user's order, both in
+        one commit. An adopted number is neither charged nor ever refunded."""
+        with self.Session() as session:
+            activation = Activation(userid=user_id, server=server, access_id=str(access_id),
+                                    phone=str(phone), service_name=service_name,
+                                    price=abs(float(price)), provider=provider,
+                                    adopted=adopted, refunded=adopted)
+            session.add(activation)
+            if not adopted:
+                session.add(Transaction(userid=user_id, transaction_detail=service_name,
+                                        amount_credited=-abs(float(price))))
+            session.commit()
+            return activation.to_dict()
+
+    def get_activation(self, activation_id):
+        with self.Session() as session:
+            activation = session.get(Activation, activation_id)
+            return activation.to_dict() if activation else None
+
+    def find_activation(self, server, access_id):
+        with self.Session() as session:
+            activation = session.query(Activation).filter_by(server=server, access_id=str(access_id)).first()
+            return activation.to_dict() if activation else None
+
+    def set_activation_status(self, activation_id, status):
+        with self.Session() as session:
+            session.query(Activation).filter_by(activation_id=activation_id).update({'status': status})
+            session.commit()
+
+    def refund_activation(self, activation_id, transaction_detail) -> bool:
+        """Credits the price back unless it was refunded before. The refunded
+        flag is claimed by a conditional update, so concurrent refunds of an
+        activation credit it once."""
+        with self.Session() as session:
+            claimed = session.query(Activation).filter_by(activation_id=activation_id, refunded=False
+                                                          ).update({'refunded': True, 'status': CANCELED})
+            if not claimed:
+                session.rollback()
+                return False
+            activation = session.get(Activation, activation_id)
+            session.add(Transaction(userid=activation.userid, transaction_detail=transaction_detail,
+                                    amount_credited=abs(activation.price)))
+            session.commit()
+            return True
+
+    def claim_update(self, update_id, keep=4096) -> bool:
+        """False when the update was claimed before. Updates older than
+        the last keep ids are cleared every keep claims of this process."""
+        with self.Session() as session:
+            session.add(ProcessedUpdate(update_id=update_id))
+            try:
+                session.commit()
+            except IntegrityError:
+                return False
+            if next(self._claims) % keep == 0:
+                session.query(ProcessedUpdate).filter(ProcessedUpdate.update_id < update_id - keep).delete()
+                session.commit()
+            return True
+
+    def release_update(self, update_id):
+        with self.Session() as session:
+            session.query(ProcessedUpdate).filter_by(update_id=update_id).delete()
+            session.commit()
+
     def get_new_members_joined(self, only_today=False):
         """
         This function fetches the number of new members joined today and overall.
@@ -176,16 +298,23 @@ class UserDatabase:
         return data
 
 
+# Activations kept in memory, the recent ones get all the check clicks
+ACTIVATION_CACHE_SIZE = get_setting('ACTIVATION_CACHE_SIZE', 2048)
+
+
 class api_point:
-    def __init__(self) -> None:
+    def __init__(self, postgreurl=None) -> None:
+        self.activations = OrderedDict()  # activation_id -> record
+        self._activations_lock = threading.Lock()
         try:
-            try:
-                from secrets_handler import VARIABLES
-                postgreurl = VARIABLES["POSTGRESQL_DB"]
-            except :
-                from dotenv import load_dotenv
-                load_dotenv()
-                postgreurl:str|None = os.environ.get('POSTGRESQL_DB')
+            if postgreurl is None:
+                try:
+                    from secrets_handler import VARIABLES
+                    postgreurl = VARIABLES["POSTGRESQL_DB"]
+                except :
+                    from dotenv import load_dotenv
+                    load_dotenv()
+                    postgreurl:str|None = os.environ.get('POSTGRESQL_DB')
             
             self.user_db = UserDatabase(postgreurl)
         except BaseException as e:
@@ -237,8 +366,83 @@ class api_point:
     def record_recharge(self, user_id, utr, amount: float):
         return self.user_db.add_recharge(user_id, amount, utr)
 
+    def claim_update(self, update_id, keep=4096) -> bool:
+        return self.user_db.claim_update(update_id, keep)
+
+    def release_update(self, update_id):
+        return self.user_db.release_update(update_id)
+
+    def _remember(self, record):
+        with self._activations_lock:
+            self.activations[record['id']] = record
+            self.activations.move_to_end(record['id'])
+            while len(self.activations) > ACTIVATION_CACHE_SIZE:
+                self.activations.popitem(last=False)
+        return record
+
+    def _forget(self, activation_id):
+        with self._activations_lock:
+            self.activations.pop(activation_id, None)
+
+    def buy_activation(self, user_id, server, access_id, phone, service_name, price, provider):
+        """Debits the price and records the number, returns the activation
+        record, or the low balance message or False like add_orders"""
+        try:
+            record = self.user_db.add_activation(user_id, server, access_id, phone,
+                                                 service_name, price, provider)
+        except Exception as e:
+            log(
+                2, f"Unable to record activation {user_id, service_name, server, access_id}"
+            )
+            if 'Low balance' in str(e):
+                return "You are running with low balance"
+            return False
+        return self._remember(record)
+
+    def activation(self, activation_id):
+        """The activation record, None for an unknown id. The record is shared,
+        don't change it."""
+        try:
+            activation_id = int(activation_id)
+        except (TypeError, ValueError):
+            return None
+        with self._activations_lock:
+            record = self.activations.get(activation_id)
+            if record is not None:
+                self.activations.move_to_end(activation_id)
+                return record
+        record = self.user_db.get_activation(activation_id)
+        return self._remember(record) if record else None
+
+    def adopt_activation(self, user_id, server, access_id, phone, service_name, provider):
+        """The record of a number issued before activations were stored,
+        recorded on first sight. What its buttons say about it comes from
+        the client, so it is never charged nor refunded and has no price."""
+        record = self.user_db.find_activation(server, access_id)
+        if record is None:
+            try:
+                record = self.user_db.add_activation(user_id, server, access_id, phone, service_name,
+                                                     0.0, provider, adopted=True)
+            except IntegrityError:
+                record = self.user_db.find_activation(server, access_id)
+        return self._remember(record)
+
+    def set_activation_status(self, activation_id, status):
+        self.user_db.set_activation_status(activation_id, status)
+        self._forget(activation_id)
+
+    def refund_activation(self, activation_id) -> bool:
+        """Refunds the activation's price to its user, True when it was
+        refunded now and False when it had been refunded before"""
+        record = self.activation(activation_id)
+        if record is None:
+            return False
+        refunded = self.user_db.refund_activation(record['id'], f"{record['service_name']} CANCELED")
+        self._forget(record['id'])
+        return refunded
+
 
-reception_api = api_point()
+reception_api = lazy('reception_api', api_point)
 
 
 # Test Case
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from .main import UserDatabase, WAITING, RECEIVED, CANCELED
+
+
+def credited(db, user_id):
+    """The balance, which the database keeps by a trigger in production"""
+    return sum(t.amount_credited for t in db.get_user_transactions(user_id))
+
+
+@pytest.fixture
+def user_db(tmp_path):
+    db = UserDatabase(f"sqlite:///{tmp_path / 'users.db'}")
+    db.add_user(7)
+    db.record_transaction(7, 'Recharge', 100)
+    return db
+
+
+def test_activation_is_recorded_with_its_order(user_db):
+    activation = user_db.add_activation(7, 'Tiger', 123456789, 919876543210,
+                                        'Telegram_Premium|Any', 12.5, 'Any')
+    assert activation['status'] == WAITING and not activation['refunded']
+    assert user_db.get_activation(activation['id']) == activation
+    assert user_db.find_activation('Tiger', '123456789') == activation
+    assert credited(user_db, 7) == pytest.approx(87.5)
+    user_db.set_activation_status(activation['id'], RECEIVED)
+    assert user_db.get_activation(activation['id'])['status'] == RECEIVED
+    assert user_db.get_activation(activation['id'] + 1) is None
+
+
+def test_activation_is_refunded_once(user_db):
+    activation = user_db.add_activation(7, 'Tiger', 1, 919876543210, 'Telegram', 12.5, 'Any')
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        refunds = list(pool.map(lambda _: user_db.refund_activation(activation['id'], 'Telegram CANCELED'),
+                                range(16)))
+    assert refunds.count(True) == 1
+    assert credited(user_db, 7) == pytest.approx(100)
+    record = user_db.get_activation(activation['id'])
+    assert record['refunded'] and record['status'] == CANCELED
+    assert not user_db.refund_activation(activation['id'], 'Telegram CANCELED')
+
+
+def test_adopted_activation_is_neither_charged_nor_refunded(user_db):
+    activation = user_db.add_activation(7, 'Fast', 'abc', 919876543210, 'Telegram', 0.0, 'Any', adopted=True)
+    assert activation['adopted'] and activation['refunded']
+    assert not user_db.refund_activation(activation['id'], 'Telegram CANCELED')
+    assert credited(user_db, 7) == pytest.approx(100)
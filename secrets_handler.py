@@ -1,4 +1,5 @@
 import os
+import sys
 from dotenv import load_dotenv
 required_secrets = [
     # General
@@ -22,5 +23,25 @@ def check_required_secrets():
     for variable in required_secrets:
         secret = os.environ.get(variable)
         if not secret:
+            # Only ask when someone is there to answer, a worker would hang
+            if not sys.stdin or not sys.stdin.isatty():
+                raise RuntimeError(f"{variable} is not set in the environment or .env")
             secret = input(f"Enter {variable}:")
         VARIABLES[variable] = secret
+
+
+def get_setting(name, default=None):
+    """Returns an optional setting from the environment,
+    cast to the type of the default when one is given"""
+    load_dotenv()
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    if isinstance(default, bool):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, (int, float)):
+        try:
+            return type(default)(value)
+        except ValueError:
+            return default
+    return value
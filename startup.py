@@ -0,0 +1,81 @@
+"""Deferred initialization of the bot's singletons.
+
+The database, the provider clients and the menu are built on first use,
+or by warm_up in the background, so importing app.py touches no network
+or database and a worker boots while any of them is down. Each phase is
+timed for app.py --profile-startup."""
+import threading
+import time
+from contextlib import contextmanager
+
+from telegram.bot import logger
+
+_lock = threading.Lock()
+timings: list[tuple[str, float]] = []
+
+
+@contextmanager
+def phase(name: str):
+    """Records how long the block took under name"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            timings.append((name, time.perf_counter() - started))
+
+
+class lazy:
+    """Stands in for the object built by factory, building it on first
+    attribute access. A failed build is retried on the next access."""
+
+    def __init__(self, name: str, factory) -> None:
+        self._name = name
+        self._factory = factory
+        self._instance = None
+        self._building = threading.Lock()
+
+    def get(self):
+        if self._instance is None:
+            with self._building:
+                if self._instance is None:
+                    with phase(self._name):
+                        self._instance = self._factory()
+        return self._instance
+
+    @property
+    def ready(self) -> bool:
+        return self._instance is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+    def __repr__(self):
+        return f"<lazy {self._name}{'' if self.ready else ', not built'}>"
+
+
+def warm_up(*objects: lazy, then=None) -> threading.Thread:
+    """Builds the objects one after the other in a background thread,
+    then calls then; failures are logged and left to the first request"""
+
+    def run():
+        for item in objects:
+            try:
+                item.get()
+            except Exception:
+                logger.exception("Warm up of %s failed, it will be retried on use", item._name)
+        if then is not None:
+            then()
+
+    thread = threading.Thread(target=run, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def report() -> str:
+    with _lock:
+        rows = list(timings)
+    width = max((len(name) for name, _ in rows), default=0)
+    lines = [f"{name:<{width}}  {seconds * 1000:9.1f} ms" for name, seconds in rows]
+    lines.append(f"{'total':<{width}}  {sum(seconds for _, seconds in rows) * 1000:9.1f} ms")
+    return "\n".join(lines)
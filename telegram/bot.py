@@ -1,19 +1,27 @@
 import requests
 import logging
-from secrets_handler import VARIABLES
+from secrets_handler import VARIABLES, get_setting
+import budget
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("Bot_logger")
 
+TELEGRAM_TIMEOUT = (get_setting('TELEGRAM_CONNECT_TIMEOUT', 3.05), get_setting('TELEGRAM_READ_TIMEOUT', 10.0))
+
 class TelegramBot:
     def __init__(self, token):
         self.base_url = f"https://api.telegram.org/bot{token}/"
-        self.send_message('890642031',"Bot Started")
 
-    def send_request(self, method, data):
+    def announce_start(self):
+        return self.send_message('890642031',"Bot Started")
+
+    def send_request(self, method, data, timeout=TELEGRAM_TIMEOUT):
+        """Posts to the bot API, raises budget.BudgetExhausted when the update has no time left"""
         url = self.base_url + method
+        timeout = budget.timeout(timeout)
         try:
-            response = requests.post(url, json=data)
+            with budget.stage('telegram'):
+                response = requests.post(url, json=data, timeout=timeout)
             response.raise_for_status()  # Raise an error for bad status codes
             logger.info("Message sent successfully: %s", response)
             return response.json()
@@ -33,6 +41,16 @@ class TelegramBot:
         }
         return self.send_request('sendMessage', data)
 
+    def answer_inline_query(self, inline_query_id, results, cache_time=300, next_offset='', is_personal=False):
+        data = {
+            'inline_query_id': inline_query_id,
+            'results': results,
+            'cache_time': cache_time,
+            'is_personal': is_personal,
+            'next_offset': next_offset
+        }
+        return self.send_request('answerInlineQuery', data)
+
     def send_photo(self, file_loc, caption, chat_id):
         with open(file_loc, "rb") as image_file:
             # Prepare data for the POST request (multipart form data)
@@ -42,7 +60,9 @@ class TelegramBot:
                 "caption": (None, caption)
             }
 
-            return requests.post(self.base_url + 'sendPhoto', files=files)
+            timeout = budget.timeout(TELEGRAM_TIMEOUT)
+            with budget.stage('telegram'):
+                return requests.post(self.base_url + 'sendPhoto', files=files, timeout=timeout)
 
 try:
     token = VARIABLES['BOT_TOKEN']
@@ -68,6 +68,20 @@ class Message:
             entity.get('type') == 'bot_command' for entity in self.entities)
         self.is_simple_message = not self.entities
 
+class InlineQuery:
+    def __init__(self, data):
+        self.update_id = data.get('update_id')
+        inline_query = data.get('inline_query', {})
+        self.inline_query_id = inline_query.get('id')
+        self.from_user = inline_query.get('from', {})
+        self.query = inline_query.get('query', '')
+        self.offset = inline_query.get('offset', '')
+        self.chat_type = inline_query.get('chat_type')
+
+        self.user_id = self.from_user.get('id')
+        self.user_first_name = self.from_user.get('first_name')
+        self.user_username = self.from_user.get('username')
+
 class phoneNumberFlow:
     format     = "server_provider_servicename_price"
     format2    = "server_provider_sericename_price_phone_actcode"
@@ -2,10 +2,13 @@ import waiter.cook_helper as ch
 from secrets_handler import VARIABLES
 from telegram.bot import bot
 from .helper import forceReply,send_buttons_mini
+from . import callback_data as cd
 from reception.bank import check_amount_received
 
 import os
 import requests
+import budget
+from telegram.bot import TELEGRAM_TIMEOUT
 
 
 MERCH_ID = VARIABLES['BHARATPE_MERCHANT_ID']
@@ -45,7 +48,7 @@ def handle_admin(request):
             merchid = VARIABLES['MERCHID']
             val = check_amount_received(utr,merchid,token)
             if val:
-                btn = [[('Activate',f'activate_{MERCH_ID}_{PAYMENT_TOKEN}')]]
+                btn = [[('Activate',cd.encode(cd.ACTIVATE, MERCH_ID, PAYMENT_TOKEN))]]
                 resp = f"We could receive {val}, the settings work fine"
                 return send_buttons_mini(user_id,msg_id,resp,btn)
             else:
@@ -63,10 +66,11 @@ def download_image(file_id):
     """Downloads an image from Telegram using its file ID."""
     bot_token = VARIABLES['BOT_TOKEN']
     url = f"https://api.telegram.org/bot{bot_token}/getFile?file_id={file_id}"
-    response = requests.get(url)
-    file_path = response.json()['result']['file_path']
-    download_url = f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
-    image_data = requests.get(download_url).content
+    with budget.stage('telegram'):
+        response = requests.get(url, timeout=budget.timeout(TELEGRAM_TIMEOUT))
+        file_path = response.json()['result']['file_path']
+        download_url = f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
+        image_data = requests.get(download_url, timeout=budget.timeout(TELEGRAM_TIMEOUT)).content
     file_path = 'new_qr.jpg'
     with open(file_path, 'wb') as f:
         f.write(image_data)
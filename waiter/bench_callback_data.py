@@ -0,0 +1,82 @@
+"""Times routing a callback through the old chain of substring checks
+against the dispatch table on the callback_data protocol.
+
+    python -m waiter.bench_callback_data [--rounds 20000]"""
+import argparse
+import timeit
+
+from . import callback_data as cd
+
+BUTTONS = {'wantNumbers', 'checkBalance', 'recharge', 'checkHistory', 'showSupport',
+           'wantFavServices', 'adminReport', 'adminSetting'}
+OPCODES = {cd.PAGE, cd.BUY, cd.REBUY, cd.CHECK, cd.CANCEL, cd.AGAIN, cd.ACTIVATE}
+PAGES = {f'p{i}' for i in range(1, 16)}
+
+
+def chain_route(q):
+    """The order of checks answer_to made before the dispatch table"""
+    if q == "wantNumbers":
+        return 'wantNumbers', []
+    elif q in PAGES:
+        return 'page', [q]
+    elif q == "checkBalance":
+        return 'checkBalance', []
+    elif q == "recharge":
+        return 'recharge', []
+    elif q == "checkHistory":
+        return 'checkHistory', []
+    elif 'buyagain' in q:
+        return 'buyagain', q.split('_')[1:]
+    elif 'buy' == q[:3]:
+        return 'buy', q.split('_')[1:]
+    elif "chk" in q:
+        return 'chk', q.split('_')
+    elif "cancel" in q:
+        return 'cancel', q.split('_')[1:]
+    elif "againOTP" in q:
+        return 'againOTP', []
+    elif "showSupport" in q:
+        return 'showSupport', []
+    elif "wantFavServices" in q:
+        return 'wantFavServices', []
+    elif "adminReport" in q:
+        return 'adminReport', []
+    elif "adminSetting" in q:
+        return 'adminSetting', []
+    elif "activate" in q:
+        return 'activate', q.split('_')[1:]
+    return None, []
+
+
+def table_route(q):
+    if q in BUTTONS:
+        return q, []
+    decoded = cd.decode(q)
+    if decoded is not None and decoded[0] in OPCODES:
+        return decoded
+    return None, []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    old = ['wantNumbers', 'p7', 'buy_Tiger_Telegram_Any', 'buyagain_Telegram_12.5_Tiger_Any',
+           'chk3_123456789_919876543210_Telegram_12.5_Tiger_Any', 'cancel_123456789_Telegram_12.5_Tiger',
+           'adminSetting']
+    new = ['wantNumbers', cd.encode(cd.PAGE, 7), cd.encode(cd.BUY, 'Tiger', 'Telegram', 'Any'),
+           cd.encode(cd.REBUY, 48213), cd.encode(cd.CHECK, 48213, 3), cd.encode(cd.CANCEL, 48213),
+           'adminSetting']
+    print(f"{'callback':<10} {'chain ns':>9} {'table ns':>9} {'bytes old/new':>14}")
+    for before, after in zip(old, new):
+        chain = timeit.timeit(lambda: chain_route(before), number=args.rounds) / args.rounds * 1e9
+        table = timeit.timeit(lambda: table_route(after), number=args.rounds) / args.rounds * 1e9
+        name = chain_route(before)[0]
+        print(f"{name:<10} {chain:>9.0f} {table:>9.0f} {len(before):>7}/{len(after):<6}")
+    encode = timeit.timeit(lambda: cd.encode(cd.CHECK, 48213, 3), number=args.rounds) / args.rounds * 1e9
+    print(f"encode of a check button: {encode:.0f} ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Compares the search backends against the linear scan the bot used before the index.
+
+    python -m waiter.bench_search [--threshold 50] [--scales 1 10 25]
+
+The menu is grown by repeating its names with a country suffix, to see how
+each backend copes as the catalogue spreads across countries."""
+import argparse
+import time
+
+from .search import searchIndex, np
+from .test_search import load_menu, linear_search, QUERIES
+
+COUNTRIES = ['in', 'us', 'uk', 'id', 'ph', 'br', 'ng', 'vn', 'ru', 'kz', 'pk', 'bd', 'eg', 'mx', 'za',
+             'ke', 'th', 'my', 'co', 'ar', 'pe', 'cl', 'tr', 'ua', 'pl']
+
+
+def grow(database: dict, scale: int) -> dict:
+    grown = dict(database)
+    for country in COUNTRIES[1:scale]:
+        grown.update({f"{code}{country}": f"{name} {country}" for code, name in database.items()})
+    return grown
+
+
+def timings(search, rounds: int) -> tuple[float, float]:
+    spent = []
+    for _ in range(rounds):
+        for query in QUERIES:
+            started = time.perf_counter()
+            search(query)
+            spent.append(time.perf_counter() - started)
+    spent.sort()
+    return spent[len(spent) // 2] * 1000, spent[int(0.99 * len(spent))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threshold', type=int, default=50)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 25])
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    menu = load_menu()
+    print(f"{'names':>7} {'backend':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    for scale in args.scales:
+        database = grow(menu, min(scale, len(COUNTRIES)))
+        backends = {'index': searchIndex(database).search}
+        if np is not None:
+            backends['numpy'] = searchIndex(database, vectorized=True).search
+        if scale == 1:
+            backends['linear'] = lambda query, threshold: linear_search(database, query, threshold)
+        for backend, search in backends.items():
+            rounds = 1 if backend == 'linear' else args.rounds
+            p50, p99 = timings(lambda query: search(query, args.threshold), rounds)
+            print(f"{len(database):>7} {backend:>8} {p50:>9.3f} {p99:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
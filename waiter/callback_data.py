@@ -0,0 +1,71 @@
+"""Callback data of the inline buttons.
+
+    <version><opcode>|<field>|<field>...
+
+The version and the opcode are one character each. Every field follows a
+bar, with bars and backslashes escaped, so fields may hold any text,
+underscores included. Telegram refuses callback data over 64 bytes.
+
+The buttons of an issued number carry its activation id."""
+
+VERSION = '2'
+SEPARATOR = '|'
+ESCAPE = '\\'
+MAX_BYTES = 64
+
+# Opcodes
+BUY = 'b'       # server, service name, provider
+REBUY = 'r'     # activation id
+CHECK = 'k'     # activation id, check count
+CANCEL = 'x'    # activation id
+AGAIN = 'a'     # activation id
+ACTIVATE = 'v'  # merchant id, token
+PAGE = 'p'      # page number
+SHOWN = 'n'     # none, the button of what the message already shows
+
+
+class CallbackDataError(ValueError):
+    """Raised for data that can't be encoded within the limit, or decoded"""
+
+
+def escape(field) -> str:
+    return str(field).replace(ESCAPE, ESCAPE * 2).replace(SEPARATOR, ESCAPE + SEPARATOR)
+
+
+def encode(opcode: str, *fields) -> str:
+    if len(opcode) != 1:
+        raise CallbackDataError(f"Opcode {opcode!r} is not one character")
+    data = VERSION + opcode + ''.join(SEPARATOR + escape(field) for field in fields)
+    if len(data.encode('utf-8')) > MAX_BYTES:
+        raise CallbackDataError(f"{data!r} is over {MAX_BYTES} bytes")
+    return data
+
+
+def decode(data: str):
+    """(opcode, fields) of the data, None for data of another version or format"""
+    if len(data) < 2 or data[0] != VERSION:
+        return None
+    opcode, body = data[1], data[2:]
+    if body and body[0] != SEPARATOR:
+        return None
+    if ESCAPE not in body:
+        return opcode, body[1:].split(SEPARATOR) if body else []
+    fields = []
+    field = []
+    escaped = False
+    for character in body[1:]:
+        if escaped:
+            field.append(character)
+            escaped = False
+        elif character == ESCAPE:
+            escaped = True
+        elif character == SEPARATOR:
+            fields.append(''.join(field))
+            field = []
+        else:
+            field.append(character)
+    if escaped:
+        raise CallbackDataError(f"{data!r} ends inside an escape")
+    if body:
+        fields.append(''.join(field))
+    return opcode, fields
@@ -1,12 +1,19 @@
 import pytest
 
 from cook.models import phone_detail, priceResponse
+from waiter.search import searchIndex, prefixIndex, normalize, np
+from waiter import callback_data as cd
 from telegram.bot import logger
 from os import path
 from cook import main as cook_local
+from cook.artifact import shared, service_code
 from dotenv import load_dotenv
-from secrets_handler import VARIABLES
+from secrets_handler import VARIABLES, get_setting
+from startup import lazy
 import json
+import threading
+import time
+from functools import lru_cache
 
 from requests import get
 
@@ -14,7 +21,45 @@ load_dotenv()
 MENU_LIST = path.join(path.dirname(path.realpath(__file__)), "menu.txt")
 PROFIT_RATE = int(VARIABLES['PROFIT_RATE']) if VARIABLES['PROFIT_RATE'] else 30
 SALES_PRICE = lambda x: int(float(x) * (1 + PROFIT_RATE / 100) + 1)
-TEMPLATES = path.join(path.dirname(__file__), "templates")
+# Try the other offers within the quoted price when the chosen server can't issue a number
+PURCHASE_FAILOVER = get_setting('PURCHASE_FAILOVER', False)
+PURCHASE_DEADLINE = get_setting('PURCHASE_DEADLINE', 20.0)
+# 'index' scores only the candidates of the search index, 'numpy' scores every name in one batch
+SEARCH_BACKEND = get_setting('SEARCH_BACKEND', 'index')
+SEARCH_CACHE_SIZE = get_setting('SEARCH_CACHE_SIZE', 512)
+
+
+class purchaseStats:
+    """Counts the number purchases, to follow the success rate and time-to-number"""
+
+    def __init__(self) -> None:
+        self.requested = 0
+        self.issued = 0
+        self.failed_over = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, issued: bool, attempts: int, seconds: float):
+        with self._lock:
+            self.requested += 1
+            if issued:
+                self.issued += 1
+                self.seconds += seconds
+                if attempts > 1:
+                    self.failed_over += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'requested': self.requested,
+                'issued': self.issued,
+                'failed_over': self.failed_over,
+                'success_rate': round(self.issued / self.requested, 3) if self.requested else None,
+                'avg_time_to_number': round(self.seconds / self.issued, 3) if self.issued else None,
+            }
+
+
+purchases = purchaseStats()
 
 
 class cookAPI:
@@ -60,11 +105,24 @@ class cookAPI:
     def check_for_otp(cls, server, access_id):
         """returns otp if received, 0 if waiting, -1 otherwise"""
         update = cook_local.get_updates(server, access_id)
+        return cls.read_update(update)
+
+    @classmethod
+    def check_for_otp_batch(cls, server, access_ids):
+        """returns {access_id: otp if received, 0 if waiting, -1 otherwise}"""
+        updates = cook_local.get_updates_batch(server, access_ids)
+        return {access_id: cls.read_update(update) for access_id, update in updates.items()}
+
+    @staticmethod
+    def read_update(update):
+        """Maps a server update to the otp, 0 if waiting, -1 if canceled and None on errors"""
         if isinstance(update, str):
             if 'wait' in update:
                 return 0
             if 'cancel' in update:
                 return -1
+            if update.startswith('Error') or update == 'Invalid':
+                return None
             return update
 
     @classmethod
@@ -77,22 +135,28 @@ class cookAPI:
 
 def encodeList(lis) -> dict:
     """Returns the dictionary with unique 7 char key for the service name"""
-    import hashlib
     name_dict = {}
     for name in lis:
         name = name.strip()
-        hash_object = hashlib.sha256(name.encode())
-        key = hash_object.hexdigest()[:7]  # Hash and truncate to 7 characters
-        name_dict[key] = name
+        name_dict[service_code(name)] = name
     return name_dict
 
 
 class serviceOperation:
     def __init__(self, file_address: str = MENU_LIST):
         self.file_address = file_address
+        self.reloads = 0
+        self.retired_hits = 0
+        self.retired_misses = 0
+        self.search_cache = None
+        self.reload()
+
+    def reload(self, download: bool = False):
+        """(Re)loads the menu database, downloading it from Cook when asked or missing,
+        and rebuilds the search index and its result cache over it"""
 
         def read_menu():
-            with open(file_address, 'r', encoding="utf-8") as file:
+            with open(self.file_address, 'r', encoding="utf-8") as file:
                 lis = file.readlines()
             return encodeList(lis)
 
@@ -104,100 +168,59 @@ class serviceOperation:
                     file.write(i + '\n')
             self.database = encodeList(lis)
 
-        def updatePages():
-            menu = self.database
-            service_list = []
-            for i in menu:
-                service = "➤" + (menu[i].replace('.', ' .')) + " /ser_" + i
-                service_list.append(service)
-
-            # Number of chunks
-            num_chunks = 15
-
-            # Ensure chunk size divides the number of rows evenly
-            chunk_size = len(service_list) // num_chunks
-
-            # Iterate through chunks
-            for i in range(num_chunks):
-                start_index = i * chunk_size
-                end_index = (i + 1) * chunk_size
-                # Get the current chunk of data as DataFrame
-                if i != num_chunks - 1:
-                    chunk_df = service_list[start_index:end_index]
-                else:
-                    chunk_df = service_list[start_index:]
-                data_to_load = chunk_df
-
-                # Export the chunk to a txt file, converting DataFrame to string representation
-                with open(path.join(TEMPLATES , f"page{i + 1}.txt"), "w", encoding='utf-8') as f:
-                    f.write("\n".join(data_to_load))
-
-        if not path.isfile(file_address):
+        artifact = None if download else shared()
+        if artifact is not None:
+            self.database = artifact.database
+        elif download or not path.isfile(self.file_address):
             logger.log(1, "Menu data Updating from Cook")
             updateAllDetails()
-            updatePages()
-
         else:
             self.database = read_menu()
 
+        vectorized = SEARCH_BACKEND == 'numpy'
+        if vectorized and np is None:
+            logger.warning("SEARCH_BACKEND is numpy but numpy is not installed, searching with the index")
+            vectorized = False
+        self.index = searchIndex(self.database, vectorized)
+        self.prefixes = prefixIndex(self.database)
+
+        # The results of the old menu leave with its cache
+        if self.search_cache is not None:
+            info = self.search_cache.cache_info()
+            self.retired_hits += info.hits
+            self.retired_misses += info.misses
+            self.reloads += 1
+        self.search_cache = lru_cache(maxsize=SEARCH_CACHE_SIZE)(self.index.search)
+
+    def search_stats(self) -> dict:
+        info = self.search_cache.cache_info()
+        hits = self.retired_hits + info.hits
+        lookups = hits + self.retired_misses + info.misses
+        return {
+            'size': info.currsize,
+            'maxsize': info.maxsize,
+            'hits': hits,
+            'misses': lookups - hits,
+            'hit_ratio': round(hits / lookups, 3) if lookups else 0.0,
+            'reloads': self.reloads,
+        }
+
     def fuzzy_search(self, query_term, threshold=80):
         """
-      Performs a fuzzy search on a list of service names based on a query term.
+      Performs a fuzzy search on the service names based on a query term.
 
       Args:
-          service_names (list): A list of service names (strings).
           query_term (str): The term to search for.
           threshold (int, optional): The minimum Levenshtein distance similarity score (0-100). Defaults to 80.
 
       Returns:
-          list: A list of service names with a Levenshtein distance below the threshold from the query term.
+          list: [similarity, name, code] of the service names above the threshold or containing the query term,
+          the most similar first, or "Not found".
       """
-
-        def levenshtein(str1, str2):
-            """
-          Calculates the Levenshtein distance between two strings.
-
-          This function calculates the minimum number of single-character edits (insertions, deletions, replacements)
-          needed to transform one string into another.
-
-          Args:
-              str1 (str): The first string.
-              str2 (str): The second string.
-
-          Returns:
-              int: The Levenshtein distance between the strings.
-          """
-            n_m = len(str1) + 1
-            d = [[0 for _ in range(n_m)] for _ in range(len(str2) + 1)]
-
-            for i in range(1, n_m):
-                d[0][i] = i
-
-            for j in range(1, len(str2) + 1):
-                d[j][0] = j
-
-            for j in range(1, len(str2) + 1):
-                for i in range(1, n_m):
-                    if str1[i - 1] == str2[j - 1]:
-                        cost = 0
-                    else:
-                        cost = 1
-                    d[j][i] = min(d[j - 1][i] + 1, d[j][i - 1] + 1,
-                                  d[j - 1][i - 1] + cost)
-
-            return d[-1][-1]
-
-        matches = []
-        for code, name in list(self.database.items()):
-            distance = levenshtein(query_term.lower(),
-                                   name.lower())
-            similarity = ((len(query_term) - distance) / len(query_term)) * 100
-            if (similarity >= threshold) or (query_term.lower() in name.lower()):
-                matches.append([similarity, name, code])
-        match_ordered = sorted(matches, key=lambda row: row[0], reverse=True)
+        matches = self.search_cache(normalize(query_term), threshold)
         if len(matches) == 0:
             return "Not found"
-        return match_ordered
+        return matches
 
     def getServiceName(self, service_code) -> str:
         if service_code in self.database:
@@ -217,7 +240,7 @@ class serviceOperation:
         if lis:
             for i, offer in enumerate(lis):
                 btn = [(f"🌐SERVER {i + 1} with cost:{SALES_PRICE(offer['cost'])}💰",
-                        f"buy_{offer['server']}_{service_name}_{offer['provider']}")]
+                        cd.encode(cd.BUY, offer['server'], service_name, offer['provider']))]
                 buttons.append(btn)
         return buttons
 
@@ -236,13 +259,51 @@ class serviceOperation:
         if server not in ['Fast', 'Tiger', '5Sim', 'Bower']:
             raise Exception("Invalid Server used to fetch phone number")
         else:
-            return cookAPI().get_phone_no(server, service_name, provider)
+            started = time.monotonic()
+            data = cookAPI().get_phone_no(server, service_name, provider)
+            purchases.record(bool(data), 1, time.monotonic() - started)
+            return data
+
+    @staticmethod
+    def getPhoneNumberWithFailover(service_name: str, server: str, provider: str, max_price: float,
+                                   deadline: float = PURCHASE_DEADLINE):
+        """Tries the chosen offer first, then the other offers from the cheapest up,
+        whose sales price is within max_price, until a number is issued or the deadline passes.
+
+        Returns dict{phone,access_id,server,provider} or None"""
+        if server not in ['Fast', 'Tiger', '5Sim', 'Bower']:
+            raise Exception("Invalid Server used to fetch phone number")
+        started = time.monotonic()
+        offers = sorted(cookAPI().get_server_list(service_name=service_name), key=lambda x: x['cost'])
+        candidates = [(server, provider)]
+        for offer in offers:
+            choice = (offer['server'], offer['provider'])
+            if SALES_PRICE(offer['cost']) <= max_price and choice not in candidates:
+                candidates.append(choice)
+
+        attempts = 0
+        for server, provider in candidates:
+            if attempts and time.monotonic() - started > deadline:
+                break
+            attempts += 1
+            data = cookAPI().get_phone_no(server, service_name, provider)
+            if data:
+                data['provider'] = provider
+                purchases.record(True, attempts, time.monotonic() - started)
+                return data
+            logger.warning(f"No number for {service_name} at {server, provider}, trying the next offer")
+        purchases.record(False, attempts, time.monotonic() - started)
 
     @staticmethod
     def getOTP(server, actCode):
         """Make API Calls to get the OTP, return -1 if canceled, 0 for waiting, and otp if sucess"""
         return cookAPI().check_for_otp(server=server, access_id=actCode)
 
+    @staticmethod
+    def getOTPBatch(server, actCodes: list) -> dict:
+        """Same as getOTP for many activations of one server, in as few API calls as the server allows"""
+        return cookAPI().check_for_otp_batch(server=server, access_ids=actCodes)
+
     @staticmethod
     def cancelPhone(server, access_id) -> bool:
         """Returns True if successfully canceled"""
@@ -255,7 +316,8 @@ class serviceOperation:
         return resp
 
 
-serviceOps = serviceOperation()
+# Built on first use, the menu may have to be downloaded from Cook
+serviceOps = lazy('serviceOps', serviceOperation)
 
 
 class testCases:
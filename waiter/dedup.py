@@ -0,0 +1,81 @@
+"""Drops the updates Telegram delivers more than once"""
+import threading
+from collections import OrderedDict
+
+from telegram.bot import logger
+from secrets_handler import get_setting
+
+# 'memory' for one worker process, 'database' when several share the webhook, 'off'
+UPDATE_DEDUP = get_setting('UPDATE_DEDUP', 'memory')
+UPDATE_DEDUP_WINDOW = get_setting('UPDATE_DEDUP_WINDOW', 4096)
+
+
+class updateDeduplicator:
+    """Remembers the last window update_ids seen by this process, and
+    claims each new one in store when given, through
+    store.claim_update(update_id, keep), which is False for an update
+    another process claimed first. A failing store lets the update through."""
+
+    def __init__(self, window: int = UPDATE_DEDUP_WINDOW, store=None) -> None:
+        self.window = window
+        self.store = store
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.first = 0
+        self.duplicates = 0
+        self.store_errors = 0
+
+    def first_delivery(self, update) -> bool:
+        """Whether the update is seen for the first time, recording it"""
+        update_id = update.get('update_id') if isinstance(update, dict) else None
+        if update_id is None:
+            return True
+        with self._lock:
+            if update_id in self._seen:
+                self.duplicates += 1
+                return False
+            self._seen[update_id] = None
+            while len(self._seen) > self.window:
+                self._seen.popitem(last=False)
+        if self.store is not None:
+            try:
+                claimed = self.store.claim_update(update_id, keep=self.window)
+            except Exception:
+                logger.exception("Couldn't claim update %s, handling it anyway", update_id)
+                with self._lock:
+                    self.store_errors += 1
+                claimed = True
+            if not claimed:
+                with self._lock:
+                    self.duplicates += 1
+                return False
+        with self._lock:
+            self.first += 1
+        return True
+
+    def release(self, update):
+        """Forgets the update, claimed but not worked on, so its
+        redelivery is taken"""
+        update_id = update.get('update_id') if isinstance(update, dict) else None
+        if update_id is None:
+            return
+        with self._lock:
+            self._seen.pop(update_id, None)
+            self.first -= 1
+        if self.store is not None:
+            try:
+                self.store.release_update(update_id)
+            except Exception:
+                logger.exception("Couldn't release update %s", update_id)
+                with self._lock:
+                    self.store_errors += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'backend': 'database' if self.store is not None else 'memory',
+                'window': len(self._seen),
+                'first': self.first,
+                'duplicates': self.duplicates,
+                'store_errors': self.store_errors,
+            }
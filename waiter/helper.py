@@ -1,6 +1,7 @@
 from os import path
 import os
 import json
+import threading
 
 from telegram.bot import bot, logger
 from telegram.models import Message,CallbackQuery
@@ -8,12 +9,20 @@ from telegram.models import Message,CallbackQuery
 
 from reception.bank import reply_for_utr
 from reception.main import reception_api
-from cook.main import get_all_balance
+from cook.main import get_all_balance, get_stats, get_health
+from budget import budget_stats
+from secrets_handler import get_setting
+from .cook_helper import serviceOps
+from .search import normalize
+from . import callback_data as cd
 
 #Variable Declaration
 module_dir = path.dirname(path.realpath(__file__))
 templates_dir = path.join(module_dir, "templates")
 ADMINS = ['1325461175','890642031','5722408084']
+# Services listed on each page of the services list, and letter buttons per row
+PAGE_SIZE = get_setting('SERVICES_PAGE_SIZE', 25)
+JUMPS_PER_ROW = 7
 
 isAdmin = lambda x:str(x) in ADMINS
 
@@ -33,9 +42,66 @@ def report_balance():
         resp += f"🛰️ {server}: ₹ {bal:.2f}\n"
     return resp
 
+def report_health():
+    health = get_health()
+    resp = '\n'
+    for server, snapshot in health.items():
+        resp += (f"🩺 {server}: {snapshot['state']}, score {snapshot['score']}"
+                 f" (errors {snapshot['error_rate']:.0%}, p95 {snapshot['p95']:.2f}s)\n")
+    return resp
+
+def report_stats():
+    """Returns the runtime counters of the bot, for monitoring"""
+    from .helper_phone import otp_poller
+    from .cook_helper import purchases
+    from .main import updates, deliveries
+    return {
+        'budget': budget_stats.stats(),
+        'cook': get_stats(),
+        'otp_poller': otp_poller.stats(),
+        'purchases': purchases.stats(),
+        'search_cache': serviceOps.search_stats(),
+        'updates': updates.stats(),
+        'deliveries': deliveries.stats() if deliveries else None,
+    }
+
 def loadTemplate(filename):
-    with open(path.join(templates_dir,filename), 'r', encoding='utf-8') as file:
-        return file.read()
+    return render.template(filename)
+
+def inline_keyboard_markup(buttons) -> str:
+    """Serialized reply_markup of rows of (text, callback_data) buttons"""
+    return json.dumps({'inline_keyboard': [[{
+        'text': button_text,
+        'callback_data': callback_data
+    } for button_text, callback_data in row] for row in buttons]})
+
+class renderCache:
+    """Static reply markups serialized once at startup, and templates
+    read again only when their file changes"""
+    def __init__(self, templates_dir=templates_dir) -> None:
+        self.templates_dir = templates_dir
+        self.templates: dict[str, tuple[int, str]] = {}
+        self.keyboards: dict[str, str] = {}
+
+    def template(self, filename) -> str:
+        file_path = path.join(self.templates_dir, filename)
+        modified = os.stat(file_path).st_mtime_ns
+        cached = self.templates.get(filename)
+        if cached is None or cached[0] != modified:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                cached = (modified, file.read())
+            self.templates[filename] = cached
+        return cached[1]
+
+    def add_keyboard(self, name, buttons):
+        self.keyboards[name] = inline_keyboard_markup(buttons)
+
+    def keyboard(self, name) -> str:
+        return self.keyboards[name]
+
+render = renderCache()
+for template in ('welcome_message.txt', 'support.txt', 'admin_option.txt'):
+    render.template(template)
 
 class BalanceHandler:
     """Handles the balance of users, and also helps in recharge"""
@@ -68,77 +134,89 @@ class BalanceHandler:
         return bot.send_request('sendMessage', payload)
 
 class ShowServices:
-    def __init__(self,templates_dir=templates_dir) -> None:
-        self.templates_dir = templates_dir
-        self.total_pages = 15
-        self.pages = {
-            'p' + str(i): self._load_page(f'page{str(i)}.txt')
-            for i in range(1, self.total_pages + 1)
-        }
-        self.buttons = self.get_button_rows()
-        self.inline_keyboard = [[{
-            'text': button_text,
-            'callback_data': callback_data
-        } for button_text, callback_data in row] for row in self.buttons]
-
-    def _load_page(self, filename):
-        return loadTemplate(filename)
-
-
-    def get_button_rows(self, max_buttons_per_row=5):
-        """
-      Creates a list of button rows with a maximum of 'max_buttons_per_row' buttons each.
-
-      Args:
-          max_buttons_per_row: The maximum number of buttons per row (default 5).
-
-      Returns:
-          A list of lists, where each inner list represents a row of buttons with labels.
-      """
-        buttons = []
-        for i in range(1, self.total_pages + 1, max_buttons_per_row):
-            # Slice pages for current row
-            row_pages = [
-                f'p{j}' for j in range(
-                    i, min(i + max_buttons_per_row, self.total_pages + 1))
-            ]
-            # Create button tuples with same labels
-            buttons.append(tuple((page, page) for page in row_pages))
-        return buttons
+    """Pages of the services list, in alphabetical order, rendered from the
+    menu the first time each is asked for, with buttons to the next and
+    previous pages and to the first page of each letter"""
+    def __init__(self, page_size=PAGE_SIZE) -> None:
+        self.page_size = page_size
+        self.database = None
+        self.entries = []
+        self.total_pages = 1
+        self.jumps = {}
+        self.rendered = {}
+        self._lock = threading.Lock()
+
+    def _sync(self):
+        """Indexes the menu again when serviceOps reloaded it"""
+        database = serviceOps.database
+        if database is self.database:
+            return
+        with self._lock:
+            if database is self.database:
+                return
+            entries = sorted(database.items(), key=lambda item: (normalize(item[1]), item[0]))
+            jumps = {}
+            for position, (_, name) in enumerate(entries):
+                first = normalize(name)[:1]
+                letter = first.upper() if 'a' <= first <= 'z' else '#'
+                jumps.setdefault(letter, position // self.page_size + 1)
+            self.entries = entries
+            self.total_pages = max(1, -(-len(entries) // self.page_size))
+            self.jumps = dict(sorted(jumps.items(), key=lambda jump: (jump[0] != '#', jump[0])))
+            self.rendered = {}
+            self.database = database
+
+    def _parse(self, page_key):
+        """The page of a 'p<n>' key, None when it is not one"""
+        self._sync()
+        key = str(page_key)
+        if key[:1] == 'p' and key[1:].isdigit() and 1 <= int(key[1:]) <= self.total_pages:
+            return int(key[1:])
+        return None
+
+    def is_page(self, page_key) -> bool:
+        return self._parse(page_key) is not None
+
+    def page_number(self, page_key) -> int:
+        """The page of a 'p<n>' key, the first page for anything else"""
+        return self._parse(page_key) or 1
+
+    def get_button_rows(self, page, jumps_per_row=JUMPS_PER_ROW):
+        """The previous / current / next row, then the rows of letters.
+        Buttons of the page shown are only answered, Telegram refuses
+        an edit that leaves the message as it is"""
+        navigation = []
+        if page > 1:
+            navigation.append(("«", cd.encode(cd.PAGE, page - 1)))
+        navigation.append((f"{page}/{self.total_pages}", cd.encode(cd.SHOWN)))
+        if page < self.total_pages:
+            navigation.append(("»", cd.encode(cd.PAGE, page + 1)))
+        letters = [(f"{letter}*", cd.encode(cd.SHOWN)) if target == page else (letter, cd.encode(cd.PAGE, target))
+                   for letter, target in self.jumps.items()]
+        return [navigation] + [letters[i:i + jumps_per_row] for i in range(0, len(letters), jumps_per_row)]
+
+    def render_page(self, page):
+        """(text, reply_markup) of a page, memoized until the menu changes"""
+        rendered = self.rendered.get(page)
+        if rendered is None:
+            start = (page - 1) * self.page_size
+            text = "\n".join("➤" + name.replace('.', ' .') + " /ser_" + code
+                             for code, name in self.entries[start:start + self.page_size])
+            rendered = (text, inline_keyboard_markup(self.get_button_rows(page)))
+            self.rendered[page] = rendered
+        return rendered
 
     def send_page(self, chat_id, page_key):
-        text = self.pages.get(page_key, self.pages['p1'])
+        text, markup = self.render_page(self.page_number(page_key))
         payload = {
             'chat_id': chat_id,
             'text': text,
-            'reply_markup':
-            json.dumps({'inline_keyboard': self.inline_keyboard})
+            'reply_markup': markup
         }
         return bot.send_request('sendMessage', payload)
 
     def update_page(self, query, page_key):
-        text = self.pages.get(page_key, self.pages['p1'])
-        # Update button text based on current page_key (logic here)
-        updated_buttons = []
-        for row in self.buttons:
-            updated_row = []
-            for button_text, callback_data in row:
-                # modify button text based on logic (e.g., add indicator for current page)
-                if button_text == page_key:
-                    new_text = f"{button_text}*"  # Example update for current page
-                else:
-                    new_text = button_text
-                updated_row.append({
-                    'text': new_text,
-                    'callback_data': callback_data
-                })
-            updated_buttons.append(updated_row)
-
-        # Generate inline keyboard with updated buttons
-        updated_inline_keyboard = [[{
-            'text': button['text'],
-            'callback_data': button['callback_data']
-        } for button in row] for row in updated_buttons]
+        text, markup = self.render_page(self.page_number(page_key))
 
         data = {
             'chat_id':
@@ -152,7 +230,7 @@ class ShowServices:
             'message_id':
             query.message_id,
             'reply_markup':
-            json.dumps({'inline_keyboard': updated_inline_keyboard})
+            markup
         }
         return bot.send_request('editMessageText', data)
 
@@ -164,8 +242,11 @@ main_inline_buttons = [[("Buy Number", "wantNumbers"),
                         ("Your Balance", "checkBalance")],
                        [("Order History", "checkHistory")],
                        [("Support", "showSupport")]]
+admin_inline_buttons = [[("Admin Report", "adminReport"),("Admin Settings","adminSetting")]]
+render.add_keyboard('user', main_inline_buttons)
+render.add_keyboard('admin', main_inline_buttons + admin_inline_buttons)
 
-def send_buttons_mini(chat_id,msg_id="", text="Welcome to the Bot",buttons= main_inline_buttons):
+def send_buttons_mini(chat_id,msg_id="", text="Welcome to the Bot",buttons=None):
     """Send followup message with the buttons
 
     Args:
@@ -174,14 +255,10 @@ def send_buttons_mini(chat_id,msg_id="", text="Welcome to the Bot",buttons= main
         text (str, optional): the text to replace the message. Defaults to "Welcome to the Bot".
         buttons (list[list[tuple[str,str]]], optional): Buttons to attach with message. Defaults to main_inline_buttons.
     """
-    inline_keyboard  = [[{
-        'text': button_text,
-        'callback_data': callback_data
-    } for button_text, callback_data in row] for row in buttons]
     payload = {
         'chat_id': chat_id,
         'text': text,
-        'reply_markup': json.dumps({'inline_keyboard': inline_keyboard})
+        'reply_markup': inline_keyboard_markup(buttons) if buttons else render.keyboard('user')
     }
     if msg_id != '':
         payload['reply_to_message_id'] = msg_id
@@ -191,38 +268,28 @@ def send_buttons_mini(chat_id,msg_id="", text="Welcome to the Bot",buttons= main
 
 
 def send_buttons(update: Message, text="Welcome to the Bot",buttons=None):
-    if not buttons:
-        buttons = main_inline_buttons
-        if isAdmin(update.chat_id):
-            buttons =main_inline_buttons + [[("Admin Report", "adminReport"),("Admin Settings","adminSetting")]]
-    inline_keyboard = [[{
-        'text': button_text,
-        'callback_data': callback_data
-    } for button_text, callback_data in row] for row in buttons]
+    if buttons:
+        markup = inline_keyboard_markup(buttons)
+    else:
+        markup = render.keyboard('admin' if isAdmin(update.chat_id) else 'user')
     payload = {
         'chat_id': update.chat_id,
         'text': text,
         'reply_to_message_id': update.message_id,
-        'reply_markup': json.dumps({'inline_keyboard': inline_keyboard})
+        'reply_markup': markup
     }
     logger.info("Sending message to %s with text: %s", update.chat_id,
                 text[:5])
     bot.send_request('sendMessage', payload)
 
 def default_query_update(response:str,query:CallbackQuery):
-    inline_keyboard = [[{
-        'text': button_text,
-        'callback_data': callback_data
-    } for button_text, callback_data in row]
-                       for row in main_inline_buttons]
-
     data = {
         'chat_id': query.chat_id,
         'callback_query_id': query.callback_query_id,
         'text': response,
         'show_alert': None,
         "message_id": query.message_id,
-        'reply_markup': json.dumps({'inline_keyboard': inline_keyboard})
+        'reply_markup': render.keyboard('user')
     }
     return bot.send_request('editMessageText', data)
 
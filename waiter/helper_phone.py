@@ -1,10 +1,17 @@
-from reception.main import reception_api
+from reception.main import reception_api, WAITING, RECEIVED, CANCELED
 from telegram.models import Message
-from .cook_helper import serviceOps
+from .cook_helper import serviceOps, PURCHASE_FAILOVER
 from .helper import send_buttons, BalanceHandler
 from telegram.bot import bot, logger
+from secrets_handler import get_setting
+from .otp_poller import otpPoller
+from . import callback_data as cd
+import budget
 import json
 
+# Push the OTP to the user without waiting for the "Check for OTP" clicks
+OTP_POLLER = get_setting('OTP_POLLER', True)
+
 
 #Get Phone Number Sequence
 def showAvailableServer(service_code, update: Message,service_name=''):
@@ -23,10 +30,11 @@ def showAvailableServer(service_code, update: Message,service_name=''):
 def sendMessageforNumber(chat_id, user_firstName, s_phone, s_name, s_price:float,
                          s_actCode,server,provider):
     
-    resp = reception_api.add_orders(chat_id,s_name,-abs(s_price))
-    if 'low' in resp:
+    activation = reception_api.buy_activation(chat_id, server, s_actCode, s_phone,
+                                              s_name, s_price, provider)
+    if isinstance(activation, str):
         return bot.send_message(chat_id,"You are running with low balance, sorry")
-    if not resp:
+    if not activation:
         return bot.send_message(chat_id,"There was some issue, no money deducted you can try again")
     response = f"here is your {str(s_phone)[:-10]} `{str(s_phone)[-10:]}` for {s_name}\n"
     logger.log(
@@ -34,7 +42,7 @@ def sendMessageforNumber(chat_id, user_firstName, s_phone, s_name, s_price:float
     inline_button = [[{
         "text":"Check for OTP",
         "callback_data":
-        f"chk_{s_actCode}_{s_phone}_{s_name}_{s_price}_{server}_{provider}"
+        cd.encode(cd.CHECK, activation['id'], 1)
     }]]
     payload = {
         'chat_id': chat_id,
@@ -43,7 +51,14 @@ def sendMessageforNumber(chat_id, user_firstName, s_phone, s_name, s_price:float
         "parse_mode": "Markdown"
     }
     # print(payload)
-    return bot.send_request('sendMessage',payload)
+    # The number is bought and paid for, a retry would buy and charge again
+    with budget.outside():
+        sent = bot.send_request('sendMessage',payload)
+    if OTP_POLLER and isinstance(sent, dict) and sent.get('ok'):
+        otp_poller.track(server, s_actCode,
+                         activation_id=activation['id'],
+                         message_id=sent['result']['message_id'])
+    return sent
 
 # Come and use this function
 def requestNumber(server,service_name,provider, chat_id, user_firstName):
@@ -63,15 +78,22 @@ def requestNumber(server,service_name,provider, chat_id, user_firstName):
         return BalanceHandler().openPortal(user_id=chat_id)
     try:
         #Generate Phone Number
-        data = serviceOps.getPhoneNumber(service_name,
-                                                       server,
-                                                       provider)
+        if PURCHASE_FAILOVER:
+            data = serviceOps.getPhoneNumberWithFailover(service_name,
+                                                         server,
+                                                         provider,
+                                                         max_price=s_price)
+        else:
+            data = serviceOps.getPhoneNumber(service_name,
+                                                           server,
+                                                           provider)
         #Record the Transaction
         return sendMessageforNumber(chat_id, user_firstName,
                                     data['phone'],
                                     service_name,
                                     float(s_price),
-                                    data['access_id'],server=data['server'],provider=provider)
+                                    data['access_id'],server=data['server'],
+                                    provider=data.get('provider', provider))
     except ValueError:
         logger.error("Failed getting number for " + service_name)
         bot.send_message(chat_id, "Sorry there was an issue getting your number for " +service_name +",\nDevelopers are notified about this and will come back to you")
@@ -82,18 +104,32 @@ def requestNumber(server,service_name,provider, chat_id, user_firstName):
         
 
 #Handle the requests for updates on OTP after getting
-def otpUpdateQuery(phoneNo, act_code, user_id, message_id, s_name, price, n,server,provider):
+def otpUpdateQuery(activation, message_id, n, otp=None):
+    """Edits the number's message with the OTP status of the activation record,
+    the otp is fetched from the server unless it is given"""
+    phoneNo, s_name = activation['phone'], activation['service_name']
+    server, act_code = activation['server'], activation['access_id']
+    user_id = activation['user_id']
     response = f"Your number : {str(phoneNo)[:-10]} `{str(phoneNo)[-10:]}`"
     response += f"\n for {s_name}"
-    otp = serviceOps.getOTP(server,act_code)
+    if activation['status'] == CANCELED:
+        otp = -1
+    elif otp is None:
+        otp = serviceOps.getOTP(server,act_code)
+    if otp not in (0, None):
+        otp_poller.forget(server, act_code)
     if otp == -1:
         # OTP is cancelled or Expired
         response += "\n is Canceled or Expired"
-        reception_api.add_orders(user_id,f"{s_name} CANCELED", abs(float(price)))
-        response += "\n And money refunded."
+        if activation['adopted']:
+            response += "\n Please contact support for its refund."
+        else:
+            if reception_api.refund_activation(activation['id']):
+                logger.log(5, f"{user_id} refunded for {s_name}")
+            response += "\n And money refunded."
         inline_button = [[{
             "text":"Buy Again",
-            "callback_data":f"buyagain_{s_name}_{price}_{server}_{provider}"
+            "callback_data":cd.encode(cd.REBUY, activation['id'])
 }]]
         payload = {
             'chat_id': user_id,
@@ -103,21 +139,21 @@ def otpUpdateQuery(phoneNo, act_code, user_id, message_id, s_name, price, n,serv
             'reply_markup': json.dumps({'inline_keyboard': inline_button})
         }
         return bot.send_request("editMessageText", payload)
-    elif otp == 0:
+    elif otp in (0, None):
         response += f"\n Is waiting for OTP ({n})"
         #Only to return when the OTP is waiting
         inline_button = [[{
             "text":
             "Check for OTP",
             "callback_data":
-            f"chk{n+1}_{act_code}_{phoneNo}_{s_name}_{price}_{server}_{provider}"
+            cd.encode(cd.CHECK, activation['id'], n + 1)
         }]]
         if n % 5 == 4:
             inline_button.append([{
                 "text":
                 "Cancel this",
                 "callback_data":
-                f"cancel_{act_code}_{s_name}_{price}_{server}"
+                cd.encode(cd.CANCEL, activation['id'])
             }])
         payload = {
             'chat_id': user_id,
@@ -129,18 +165,20 @@ def otpUpdateQuery(phoneNo, act_code, user_id, message_id, s_name, price, n,serv
         return bot.send_request('editMessageText', payload)
     else:
         response += f"\n Recieved OTP : `{otp}`"
+        if activation['status'] == WAITING:
+            reception_api.set_activation_status(activation['id'], RECEIVED)
         #When OTP success
         inline_button = [[{
             "text":
             "Need OTP again",
             "callback_data":
-            f"againOTP_{act_code}_{phoneNo}_{s_name}_{price}_{server}"
+            cd.encode(cd.AGAIN, activation['id'])
         }],
                          [{
             "text":
             "Buy Again",
             "callback_data":
-            f"buyagain_{s_name}_{price}_{server}_{provider}"
+            cd.encode(cd.REBUY, activation['id'])
         }]
                          ]
         payload = {
@@ -151,3 +189,16 @@ def otpUpdateQuery(phoneNo, act_code, user_id, message_id, s_name, price, n,serv
             'reply_markup': json.dumps({'inline_keyboard': inline_button})
         }
         return bot.send_request("editMessageText", payload)
+
+
+def pushOtpUpdate(tracked, otp):
+    """Edits the user's message once the poller knows the OTP or the cancelation"""
+    activation = reception_api.activation(tracked['activation_id'])
+    if activation is None:
+        logger.error(f"Polled activation {tracked['activation_id']} is not recorded")
+        return None
+    return otpUpdateQuery(activation, tracked['message_id'], n=tracked['n'], otp=otp)
+
+
+otp_poller = otpPoller(check_batch=lambda server, ids: serviceOps.getOTPBatch(server, ids),
+                       on_update=pushOtpUpdate)
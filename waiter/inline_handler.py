@@ -0,0 +1,38 @@
+from telegram.bot import bot, logger
+from telegram.models import InlineQuery
+from secrets_handler import get_setting
+from .cook_helper import serviceOps
+
+# Telegram shows at most 50 results per answer, the rest come with the next offset
+INLINE_PAGE_SIZE = 50
+# Seconds Telegram may serve the answer from its own cache, kept short so
+# services added or removed from the menu show up quickly
+INLINE_CACHE_TIME = get_setting('INLINE_CACHE_TIME', 10)
+
+
+def article(name, code) -> dict:
+    """Result that sends the /ser_ command of the service when picked"""
+    return {
+        'type': 'article',
+        'id': code,
+        'title': name,
+        'description': f"/ser_{code}",
+        'input_message_content': {'message_text': f"/ser_{code}"}
+    }
+
+
+def answer_inline(request):
+    query = InlineQuery(request)
+    try:
+        offset = int(query.offset or 0)
+    except ValueError:
+        offset = 0
+    found = serviceOps.prefixes.search(query.query)
+    page = found[offset:offset + INLINE_PAGE_SIZE]
+    more = offset + INLINE_PAGE_SIZE < len(found)
+    logger.debug("Inline query %r from %s: %d results", query.query, query.user_id, len(found))
+    return bot.answer_inline_query(query.inline_query_id,
+                                   [article(name, code) for name, code in page],
+                                   cache_time=INLINE_CACHE_TIME,
+                                   is_personal=True,
+                                   next_offset=str(offset + INLINE_PAGE_SIZE) if more else '')
@@ -1,24 +1,118 @@
 from telegram.bot import bot,logger
 from .query_handler import answer_to
 from .message_handler import respond_to
+from .inline_handler import answer_inline
+from .workers import workerPool
+from .dedup import updateDeduplicator, UPDATE_DEDUP
+from reception.main import reception_api
+import budget
+from budget import BudgetExhausted
 
 def workOn(request):
+    """Handles the update within its time budget,
+    replying that we are slow when the budget runs out"""
+    try:
+        with budget.begin():
+            with budget.stage('waiter'):
+                return dispatch(request)
+    except BudgetExhausted:
+        logger.warning("Update %s ran out of its time budget", request.get('update_id'))
+        return sendSlowReply(request)
+
+def dispatch(request):
     if 'callback_query' in request:
         try:
             return answer_to(request)
+        except BudgetExhausted:
+            raise
         except Exception as e:
             logger.exception("Error processing callback req")
             print(request)
     elif 'message' in request:
         try:
             return respond_to(request)       
+        except BudgetExhausted:
+            raise
         except Exception as e:
             logger.exception("Error processing message req")
             print(request)
+    elif 'inline_query' in request:
+        try:
+            return answer_inline(request)
+        except BudgetExhausted:
+            raise
+        except Exception as e:
+            logger.exception("Error processing inline query")
+            print(request)
     else:
         print(request)
         logger.warning("Unusual Request")
 
+def replyFor(request, text):
+    """(method, data) of the bot API call answering the update with text,
+    None for updates that can't be answered"""
+    if 'callback_query' in request:
+        return 'answerCallbackQuery', {
+            'callback_query_id': request['callback_query']['id'],
+            'text': text
+        }
+    elif 'message' in request:
+        return 'sendMessage', {'chat_id': request['message']['chat']['id'], 'text': text}
+    elif 'inline_query' in request:
+        # Nothing to show, and nothing Telegram should keep
+        return 'answerInlineQuery', {
+            'inline_query_id': request['inline_query']['id'],
+            'results': [],
+            'cache_time': 0
+        }
+    return None
+
+def sendSlowReply(request):
+    reply = replyFor(request, "This is taking longer than usual, please try again in a moment")
+    if reply is not None:
+        return bot.send_request(*reply)
+
+def busyReply(request):
+    """The reply to an update shed because every worker is busy"""
+    return replyFor(request, "We are busy right now, please try again in a moment")
+
+def chatOf(request):
+    """Id of the chat the update belongs to, None when it has none"""
+    try:
+        if 'callback_query' in request:
+            callback = request['callback_query']
+            message = callback.get('message')
+            return message['chat']['id'] if message else callback['from']['id']
+        for kind in ('message', 'edited_message'):
+            if kind in request:
+                return request[kind]['chat']['id']
+        if 'inline_query' in request:
+            return request['inline_query']['from']['id']
+    except (KeyError, TypeError, AttributeError):
+        logger.warning("Update %s has no chat", request.get('update_id'))
+    return None
+
+def acceptUpdate(request) -> bool:
+    """Whether the update should be worked on, False for a redelivery"""
+    if deliveries is None:
+        return True
+    if deliveries.first_delivery(request):
+        return True
+    logger.info("Dropped redelivered update %s", request.get('update_id'))
+    return False
+
+def releaseUpdate(request):
+    """Undoes acceptUpdate for an update that couldn't be queued"""
+    if deliveries is not None:
+        deliveries.release(request)
+
+# Redeliveries are dropped before the pool
+deliveries = None if UPDATE_DEDUP == 'off' else updateDeduplicator(
+    store=reception_api if UPDATE_DEDUP == 'database' else None)
+
+# Every update is worked on by this pool, in order within its chat
+updates = workerPool(workOn, name='update', key=chatOf)
+
 #Set the Webhook
 def setWebhook(url):
     url =  (url.split(sep="/"))[2]
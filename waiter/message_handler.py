@@ -13,30 +13,22 @@ class Commands:
         self.update = update
         self.name = update.user_first_name
         self.user_id = update.user_id
-        self.commands_map ={
-            "/start":self.start,
-            "/getnum":self.getnum,
-            "/checkbal":self.checkbal,
-            "/recharge":self.recharge,
-            "/seefav":self.getfavlist,
-            "/seehist":self.checkhistory,
-            "/referal":self.getreferral,
-            "/update_prices":self.update_price,
-            "/update_payment":self.update_payment
-        }
-        
+
     def run(self):
-        command = self.update.text
-        if "ser_" in command:
-            service_code = str(command)[5:]
-            # This will check for the available services for this number
-            return showAvailableServer(service_code,self.update)
-        try:
-            return self.commands_map[command]()
-        except KeyError as e:
-            logger.error(str(e))
-            bot.reply_message(self.user_id,self.update.message_id,
-                            "Invalid Command")
+        # "/start@OurBot" when the command is picked in a group
+        command = (str(self.update.text).split() or [''])[0].split('@')[0]
+        if command in self.commands_map:
+            return self.commands_map[command](self)
+        prefix, _, argument = command.partition('_')
+        if prefix in self.prefixed_map:
+            return self.prefixed_map[prefix](self, argument)
+        logger.error("Invalid command %r", command)
+        bot.reply_message(self.user_id,self.update.message_id,
+                        "Invalid Command")
+
+    def showservice(self, service_code):
+        # This will check for the available services for this number
+        return showAvailableServer(service_code,self.update)
             
         
     def start(self):
@@ -87,6 +79,22 @@ class Commands:
 
     def getreferral(self):
         return send_buttons(self.update,"Your referral scores")
+
+    commands_map = {
+        "/start":start,
+        "/getnum":getnum,
+        "/checkbal":checkbal,
+        "/recharge":recharge,
+        "/seefav":getfavlist,
+        "/seehist":checkhistory,
+        "/referal":getreferral,
+        "/update_prices":update_price,
+        "/update_payment":update_payment
+    }
+    # Commands carrying an argument after an underscore, like /ser_<code>
+    prefixed_map = {
+        "/ser":showservice,
+    }
         
 
 #Handle the messages
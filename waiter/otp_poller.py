@@ -0,0 +1,151 @@
+"""Polls the servers in the background for the OTP of every issued number"""
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.bot import logger
+from secrets_handler import get_setting
+
+OTP_POLL_FIRST = get_setting('OTP_POLL_FIRST', 3.0)
+OTP_POLL_MAX = get_setting('OTP_POLL_MAX', 30.0)
+OTP_POLL_LIFETIME = get_setting('OTP_POLL_LIFETIME', 1200.0)
+
+
+class otpPoller:
+    """Keeps polling each tracked activation, quickly at first and then
+    slower, until the OTP arrives, the number is canceled or it expires.
+
+    The due activations of a server are checked together each tick through
+    check_batch(server, access_ids), which follows serviceOperation.getOTPBatch
+    and maps each access_id to the otp, 0 while waiting, -1 when canceled
+    and None on errors. on_update(activation, otp) is called once the otp
+    or -1 is known."""
+
+    def __init__(self, check_batch, on_update,
+                 first_delay: float = OTP_POLL_FIRST,
+                 max_delay: float = OTP_POLL_MAX,
+                 lifetime: float = OTP_POLL_LIFETIME,
+                 backoff: float = 1.5,
+                 workers: int = 8) -> None:
+        self.check_batch = check_batch
+        self.on_update = on_update
+        self.first_delay = first_delay
+        self.max_delay = max_delay
+        self.lifetime = lifetime
+        self.backoff = backoff
+        self._heap = []  # (due, seq, key)
+        self._active = {}  # (server, access_id) -> activation
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='otp')
+        self.batches = 0
+        self.checks = 0
+        self.pushed = 0
+        self.expired = 0
+
+    def track(self, server, access_id, **details):
+        """Starts polling the activation, details are handed back to on_update"""
+        key = (server, str(access_id))
+        now = time.monotonic()
+        activation = dict(details, server=server, access_id=str(access_id),
+                          started=now, delay=self.first_delay, n=0)
+        with self._cond:
+            self._active[key] = activation
+            heapq.heappush(self._heap, (now + self.first_delay, next(self._seq), key))
+            self._ensure_running()
+            self._cond.notify()
+
+    def forget(self, server, access_id):
+        """Stops polling the activation, when its final state is already known"""
+        with self._cond:
+            self._active.pop((server, str(access_id)), None)
+
+    def _ensure_running(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='otp-poller', daemon=True)
+            self._thread.start()
+
+    def _next_due(self):
+        """Waits for and returns the keys whose poll is due"""
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0][2] not in self._active:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                wait_for = self._heap[0][0] - time.monotonic()
+                if wait_for > 0:
+                    self._cond.wait(wait_for)
+                    continue
+                due = []
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, key = heapq.heappop(self._heap)
+                    if key in self._active:
+                        due.append(key)
+                return due
+
+    def _run(self):
+        while True:
+            due = {}
+            for key in self._next_due():
+                due.setdefault(key[0], []).append(key)
+            for server, keys in due.items():
+                self._workers.submit(self._poll, server, keys)
+
+    def _poll(self, server, keys):
+        with self._cond:
+            activations = {key: self._active[key] for key in keys if key in self._active}
+        if not activations:
+            return
+        with self._cond:
+            self.batches += 1
+        try:
+            otps = self.check_batch(server, [access_id for _, access_id in activations])
+        except Exception:
+            logger.exception(f"Error polling the otp at {server}")
+            otps = {}
+        for key, activation in activations.items():
+            self._settle(key, activation, otps.get(key[1]))
+
+    def _settle(self, key, activation, otp):
+        """Pushes a final otp to the user, or schedules the next poll"""
+        with self._cond:
+            self.checks += 1
+            if key not in self._active:
+                return
+            activation['n'] += 1
+            if otp not in (0, None):
+                del self._active[key]
+                final = True
+            elif time.monotonic() - activation['started'] > self.lifetime:
+                del self._active[key]
+                self.expired += 1
+                return
+            else:
+                final = False
+                activation['delay'] = min(activation['delay'] * self.backoff, self.max_delay)
+                heapq.heappush(self._heap, (time.monotonic() + activation['delay'], next(self._seq), key))
+                self._cond.notify()
+        if final:
+            try:
+                self.on_update(activation, otp)
+            except Exception:
+                logger.exception(f"Error pushing the otp of {key}")
+            else:
+                with self._cond:
+                    self.pushed += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'tracked': len(self._active),
+                'batches': self.batches,
+                'checks': self.checks,
+                'pushed': self.pushed,
+                'expired': self.expired,
+            }
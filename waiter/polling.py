@@ -0,0 +1,125 @@
+"""Receives the updates by long polling getUpdates instead of the webhook,
+to run behind NAT or in load tests without a public url.
+
+    python app.py --poll    or    python -m waiter.polling
+
+Telegram keeps every update until a getUpdates call with a higher offset,
+so the offset only moves past an update once it is queued on the pool.
+When the pool is full the batch waits, instead of being shed."""
+import time
+
+from secrets_handler import check_required_secrets, get_setting
+check_required_secrets()
+
+from telegram.bot import bot, logger, TELEGRAM_TIMEOUT
+from .main import updates, acceptUpdate, releaseUpdate
+
+POLL_TIMEOUT = get_setting('POLL_TIMEOUT', 30)
+POLL_LIMIT = get_setting('POLL_LIMIT', 100)
+POLL_RETRY_MAX = get_setting('POLL_RETRY_MAX', 30.0)
+ALLOWED_UPDATES = ['message', 'callback_query', 'inline_query']
+
+
+class updatePoller:
+    def __init__(self, pool=updates, accept=acceptUpdate, release=releaseUpdate, api=bot,
+                 timeout: int = POLL_TIMEOUT, limit: int = POLL_LIMIT) -> None:
+        self.pool = pool
+        self.accept = accept
+        self.release = release
+        self.api = api
+        self.timeout = timeout
+        self.limit = limit
+        self.offset = None
+        self.running = False
+        self.batches = 0
+        self.received = 0
+        self.held = 0
+        self.errors = 0
+
+    def delete_webhook(self) -> bool:
+        """getUpdates is refused while a webhook is set"""
+        response = self.api.send_request('deleteWebhook', {'drop_pending_updates': False})
+        if not isinstance(response, dict) or not response.get('ok'):
+            logger.error("deleteWebhook failed: %s", response)
+            return False
+        return True
+
+    def fetch(self):
+        """The next batch of updates, None when the call failed"""
+        data = {'timeout': self.timeout, 'limit': self.limit, 'allowed_updates': ALLOWED_UPDATES}
+        if self.offset is not None:
+            data['offset'] = self.offset
+        connect, read = TELEGRAM_TIMEOUT
+        response = self.api.send_request('getUpdates', data, timeout=(connect, read + self.timeout))
+        if not isinstance(response, dict) or not response.get('ok'):
+            logger.error("getUpdates failed: %s", response)
+            return None
+        return response['result']
+
+    def enqueue(self, batch):
+        """Queues the batch in order, waiting while the pool is full"""
+        for update in batch:
+            if self.accept(update):
+                try:
+                    while not self.pool.submit(update):
+                        self.held += 1
+                        if not self.running:
+                            # Claimed but not queued, it's delivered again after a restart
+                            self.release(update)
+                            return
+                        time.sleep(0.05)
+                except BaseException:
+                    # Same for ctrl-c while waiting for a free slot
+                    self.release(update)
+                    raise
+            self.offset = update['update_id'] + 1
+
+    def run(self):
+        """Polls until stop or ctrl-c, then confirms what was worked on"""
+        self.running = True
+        webhook_deleted = False
+        delay = 1.0
+        try:
+            while self.running:
+                if not webhook_deleted:
+                    webhook_deleted = self.delete_webhook()
+                batch = self.fetch() if webhook_deleted else None
+                if batch is None:
+                    # A webhook set meanwhile fails every getUpdates, delete it again
+                    webhook_deleted = False
+                    self.errors += 1
+                    time.sleep(delay)
+                    delay = min(delay * 2, POLL_RETRY_MAX)
+                    continue
+                delay = 1.0
+                self.batches += 1
+                self.received += len(batch)
+                self.enqueue(batch)
+        except KeyboardInterrupt:
+            logger.info("Polling stopped")
+        finally:
+            self.running = False
+            self.pool.join()
+            if self.offset is not None:
+                self.api.send_request('getUpdates', {'offset': self.offset, 'timeout': 0, 'limit': 1})
+
+    def stop(self):
+        self.running = False
+
+    def stats(self) -> dict:
+        return {
+            'offset': self.offset,
+            'batches': self.batches,
+            'received': self.received,
+            'held': self.held,
+            'errors': self.errors,
+        }
+
+
+def main():
+    logger.info("Receiving updates by long polling")
+    updatePoller().run()
+
+
+if __name__ == '__main__':
+    main()
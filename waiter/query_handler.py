@@ -1,10 +1,200 @@
-from .helper_phone import otpUpdateQuery,requestNumber
+from .helper_phone import otpUpdateQuery,requestNumber,otp_poller
 from telegram.models import CallbackQuery
 from .helper import default_query_update, services, BalanceHandler,loadTemplate,report_balance,report_reception,switch_files
 from .cook_helper import serviceOps
+from . import callback_data as cd
 from telegram.bot import bot, logger
 from reception.main import reception_api
 from secrets_handler import VARIABLES
+from budget import BudgetExhausted
+
+
+def answer_with(query: CallbackQuery, response):
+    """Shows the response as the callback's notification and as the message text"""
+    data = {
+        'callback_query_id': query.callback_query_id,
+        'text':response
+    }
+    bot.send_request('answerCallbackQuery',data)
+    return default_query_update(response, query=query)
+
+# Buttons without parameters
+def want_numbers(query):
+    return services.send_page(query.chat_id, 'p1')
+
+def check_balance(query):
+    bal = reception_api.see_balance(user_id=query.chat_id)
+    return answer_with(query, f"Your Balance is {bal:.2f} ")
+
+def recharge(query):
+    return BalanceHandler().openPortal(query.chat_id)
+
+def check_history(query):
+    response = " Check History here\n"
+    response += reception_api.see_transactions(query.chat_id)
+    return answer_with(query, response)
+
+def show_support(query):
+    return answer_with(query, loadTemplate("support.txt"))
+
+def want_fav_services(query):
+    lis = reception_api.get_favourite_services(user_id=query.chat_id)
+    return answer_with(query, serviceOps.list_items_with_commands(lis))
+
+def admin_report(query):
+    response = "Our Server Balances Now are \n" + str(report_balance())
+    response += "\n Reports \n" + str(report_reception())
+    return answer_with(query, response)
+
+def admin_setting(query):
+    return answer_with(query, loadTemplate("admin_option.txt"))
+
+# Buttons with parameters, see callback_data for their fields
+def show_page(query, page):
+    return services.update_page(query, f'p{page}')
+
+def already_shown(query):
+    return bot.send_request('answerCallbackQuery', {'callback_query_id': query.callback_query_id})
+
+def buy(query, server, service_name, provider):
+    logger.log(3,f"{query.from_user_username} buy {service_name,server,provider}")
+    return requestNumber(server,service_name,provider,query.chat_id,query.from_user_username)
+
+def own_activation(query, activation_id):
+    """The activation record, None unless it was issued to the clicking user"""
+    activation = reception_api.activation(activation_id)
+    if activation is None or activation['user_id'] != query.chat_id:
+        logger.error(f"{query.chat_id} clicked for activation {activation_id} not theirs")
+        answer_with(query, "This number is not available anymore")
+        return None
+    return activation
+
+def buy_again(query, activation_id):
+    activation = own_activation(query, activation_id)
+    if activation is None:
+        return None
+    service_name, server, provider = activation['service_name'], activation['server'], activation['provider']
+    logger.log(3,f"{query.from_user_username} rebuys {service_name,server,provider}")
+    return requestNumber(server,service_name,provider,query.chat_id,query.from_user_username)
+
+def check_otp(query, activation_id, n):
+    activation = own_activation(query, activation_id)
+    if activation is None:
+        return None
+    try:
+        n = int(n)
+    except ValueError:
+        n = 1
+    return otpUpdateQuery(activation, query.message_id, n=n)
+
+def cancel(query, activation_id):
+    activation = own_activation(query, activation_id)
+    if activation is None:
+        return None
+    user_id, sname = query.chat_id, activation['service_name']
+    if activation['adopted']:
+        return answer_with(query, f"The {sname} was bought before our last update, "
+                                  "please contact support to cancel it")
+    if activation['refunded']:
+        otp_poller.forget(activation['server'], activation['access_id'])
+        return answer_with(query, f"The {sname} is already deactivated, and money refunded")
+    x = serviceOps.cancelPhone(activation['server'],activation['access_id'])
+    if x:
+        # Before the refund, so that the poller doesn't push the -1 and refund too
+        otp_poller.forget(activation['server'], activation['access_id'])
+        if reception_api.refund_activation(activation['id']):
+            logger.log(5, f"{user_id} cancelled {sname}")
+        return answer_with(query, f"The {sname} is deactivated, and money refunded")
+    logger.error(
+        f"{sname} couldnot deactivate, no refund yet {user_id}")
+    response = {
+        "callback_query_id": query.callback_query_id,
+        'text':"There was issue with deactivation"
+        }
+    return bot.send_request('answerCallbackQuery',response)
+
+def otp_again(query, *fields):
+    return bot.send_message(query.chat_id,"Requesting more otp is not allowed now.")
+
+# Buttons sent before activations were stored carry the activation itself.
+# Clients can send any callback data, so these only show the status.
+def adopt(query, act_code, phoneNo, sname, server, provider=''):
+    return reception_api.adopt_activation(query.chat_id, server, act_code, phoneNo,
+                                          sname, provider)['id']
+
+def legacy_buy_again(query, service_name, price, server, provider):
+    logger.log(3,f"{query.from_user_username} rebuys {service_name,server,provider}")
+    return requestNumber(server,service_name,provider,query.chat_id,query.from_user_username)
+
+def legacy_check_otp(query, n, act_code, phoneNo, sname, price, server, provider):
+    return check_otp(query, adopt(query, act_code, phoneNo, sname, server, provider), n)
+
+def legacy_cancel(query, act_code, sname, price, server):
+    return cancel(query, adopt(query, act_code, '', sname, server))
+
+def activate(query, merch_id, token):
+    try:
+        VARIABLES['BHARATPE_MERCHANT_ID'] = merch_id
+        VARIABLES['BHARATPE_TOKEN'] = token
+        switch_files('qr.png','new_qr.jpg')
+        response = "New Payment Updated"
+    except Exception as e:
+        logger.exception(e)
+        response = '‼️ New Payment update failed'
+    return answer_with(query, response)
+
+
+BUTTONS = {
+    "wantNumbers": want_numbers,
+    "checkBalance": check_balance,
+    "recharge": recharge,
+    "checkHistory": check_history,
+    "showSupport": show_support,
+    "wantFavServices": want_fav_services,
+    "adminReport": admin_report,
+    "adminSetting": admin_setting,
+}
+
+OPCODES = {
+    cd.PAGE: show_page,
+    cd.SHOWN: already_shown,
+    cd.BUY: buy,
+    cd.REBUY: buy_again,
+    cd.CHECK: check_otp,
+    cd.CANCEL: cancel,
+    cd.AGAIN: otp_again,
+    cd.ACTIVATE: activate,
+}
+
+
+def legacy_route(q):
+    """Handler and fields of the underscore separated data of
+    the buttons sent before the callback_data protocol"""
+    if services.is_page(q):
+        return show_page, [q[1:]]
+    head, *fields = q.split('_')
+    if head.startswith('chk'):
+        # chk{n+1}_{act_code}_{phoneNo}_{s_name}_{price}_{server}_{provider}
+        return legacy_check_otp, [head[len('chk'):]] + fields
+    legacy = {
+        'buy': buy,                    # buy_{server}_{s_name}_{provider}
+        'buyagain': legacy_buy_again,  # buyagain_{s_name}_{price}_{server}_{provider}
+        'cancel': legacy_cancel,       # cancel_{act_code}_{s_name}_{price}_{server}
+        'againOTP': otp_again,         # againOTP_{act_code}_{phoneNo}_{s_name}_{price}_{server}
+        'activate': activate,          # activate_{merch_id}_{token}
+    }
+    return legacy.get(head), fields
+
+
+def route(q):
+    """Handler and fields for the callback data"""
+    if q in BUTTONS:
+        return BUTTONS[q], []
+    decoded = cd.decode(q)
+    if decoded is not None:
+        opcode, fields = decoded
+        return OPCODES.get(opcode), fields
+    return legacy_route(q)
 
 
 def answer_to(request):
@@ -13,104 +203,14 @@ def answer_to(request):
     except Exception as e:
         logger.critical("Invalid Query Received")
         raise e from None
-    q = query.data
-    user_id = query.chat_id
-    user_name = query.from_user_username
-    # These handles the pages in the show services
+    q = query.data or ''
     try:
-        if q == "wantNumbers":
-            return services.send_page(query.chat_id, 'p1')
-        elif q in services.pages:
-            return services.update_page(query, q)
-        elif q == "checkBalance":
-            bal = reception_api.see_balance(user_id=user_id)
-            response = f"Your Balance is {bal:.2f} "
-        elif q == "recharge":
-            return BalanceHandler().openPortal(user_id)
-        elif q == "checkHistory":
-            response = " Check History here\n"
-            txn = reception_api.see_transactions(user_id)
-            response+=txn
-        #Checking for OTP and Canceling Queries
-        
-        elif 'buyagain' in q:
-            # buyagain_{s_name}_{price}_{server}_{provider}
-            _,service_name,price,server,provider = q.split('_')
-            logger.log(3,f"{user_name} rebuys {service_name,server,provider}")
-            return requestNumber(server,service_name,provider,user_id,user_name)
-
-        elif 'buy' == q[:3]:
-            _,server,service_name,provider = q.split('_')
-            logger.log(3,f"{user_name} buy {service_name,server,provider}")
-            return requestNumber(server,service_name,provider,user_id,user_name)
-            
-        elif "chk" in q:
-            #chk{n+1}_{act_code}_{phoneNo}_{s_name}_{price}_{server}_{provider}
-            n, act_code, phoneNo, sname, price,server,provider = q.split("_")
-            try:
-                n = int(n.split('chk')[-1])
-            except ValueError:
-                n = 1
-            return otpUpdateQuery(phoneNo,
-                                act_code,
-                                user_id,
-                                query.message_id,
-                                s_name=sname,
-                                price=price,
-                                n=n,
-                                server=server,
-                                provider=provider)
-        elif "cancel" in q:
-            # Once check for OTP the last time, before canceling
-            _, act_code, sname, price,server = q.split("_")
-            x = serviceOps.cancelPhone(server,act_code)
-            if x:
-                response = f"The {sname} is deactivated, and money refunded"
-                reception_api.add_orders(user_id, f"{sname} CANCELED", float(price))
-                logger.log(5, f"{user_id} cancelled {sname}")
-            else:
-                logger.error(
-                    f"{sname} couldnot deactivate, no refund yet {user_id}")
-                response = {
-                    "callback_query_id": query.callback_query_id,
-                    'text':"There was issue with deactivation"
-                    }
-                
-                return bot.send_request('answerCallbackQuery',response)
-                # return bot.send_message(user_id,response)
-        elif "againOTP" in q:
-            return bot.send_message(user_id,"Requesting more otp is not allowed now.")
-        
-            
-        elif "showSupport" in q:
-            response = loadTemplate("support.txt")
-        elif "wantFavServices" in q:
-            lis = reception_api.get_favourite_services(user_id=user_id)
-            response = serviceOps.list_items_with_commands(lis)
-        elif "adminReport" in q:
-            response = "Our Server Balances Now are \n" + str(report_balance())
-            response += "\n Reports \n" + str(report_reception())
-        elif "adminSetting" in q:
-            response = loadTemplate("admin_option.txt")
-        elif "activate" in q:
-            _, merch_id, token = q.split('_')
-            try:
-                VARIABLES['BHARATPE_MERCHANT_ID'] = merch_id
-                VARIABLES['BHARATPE_TOKEN'] = token
-                switch_files('qr.png','new_qr.jpg')
-                response = "New Payment Updated"
-            except Exception as e:
-                logger.exception(e)
-                response = '‼️ New Payment update failed'
-        else:
-            response = "You clicked for " + query.data
-            #These will change the message text for the queries
-    except:
-        response = "Some error occcured, please try again"
-    data = {
-        'callback_query_id': query.callback_query_id,
-        'text':response
-    }
-    bot.send_request('answerCallbackQuery',data)
-    default_query_update(response, query=query)
-
+        handler, fields = route(q)
+        if handler is None:
+            return answer_with(query, "You clicked for " + q)
+        return handler(query, *fields)
+    except BudgetExhausted:
+        raise
+    except Exception:
+        logger.exception("Callback %r failed", q)
+        return answer_with(query, "Some error occcured, please try again")
@@ -0,0 +1,270 @@
+"""Search index over the service names"""
+import unicodedata
+from bisect import bisect_left
+
+try:
+    import numpy as np
+except ImportError:  # Only the vectorized scorer needs it
+    np = None
+
+# Look-alike letters folded to the latin letter they are mistaken for,
+# the menu has names like "163сom" and "1хbet" written with cyrillic letters
+HOMOGLYPHS = str.maketrans({
+    'а': 'a', 'в': 'b', 'е': 'e', 'к': 'k', 'м': 'm', 'н': 'h', 'о': 'o', 'р': 'p',
+    'с': 'c', 'т': 't', 'у': 'y', 'х': 'x', 'і': 'i', 'ј': 'j', 'ѕ': 's', 'һ': 'h',
+    'ԁ': 'd', 'ԛ': 'q', 'ԝ': 'w',
+    'α': 'a', 'β': 'b', 'ε': 'e', 'ι': 'i', 'κ': 'k', 'ν': 'v', 'ο': 'o', 'ρ': 'p',
+    'τ': 't', 'υ': 'u', 'χ': 'x',
+})
+GRAM = 3
+
+
+def normalize(text: str) -> str:
+    """Returns the search key of a text, unicode normalized,
+    case folded, without accents and with homoglyphs folded"""
+    text = unicodedata.normalize('NFKD', text.strip().casefold())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return unicodedata.normalize('NFC', text).translate(HOMOGLYPHS)
+
+
+def grams(key: str) -> set[str]:
+    return {key[i:i + GRAM] for i in range(len(key) - GRAM + 1)}
+
+
+def match_vectors(pattern: str) -> dict[str, int]:
+    """Bitmask of the positions of each character of the pattern"""
+    vectors: dict[str, int] = {}
+    for i, character in enumerate(pattern):
+        vectors[character] = vectors.get(character, 0) | 1 << i
+    return vectors
+
+
+def levenshtein(pattern: str, text: str, vectors: dict[str, int] | None = None, limit: int | None = None) -> int:
+    """Levenshtein distance, one column of the matrix per character of text
+    held in the bits of two integers (Myers' bit-parallel algorithm).
+    With a limit, stops with limit + 1 as soon as the distance is known to be above it"""
+    if limit is not None and abs(len(pattern) - len(text)) > limit:
+        return limit + 1
+    if not pattern:
+        return len(text)
+    if vectors is None:
+        vectors = match_vectors(pattern)
+    full = (1 << len(pattern)) - 1
+    last = 1 << len(pattern) - 1
+    positive, negative, distance = full, 0, len(pattern)
+    remaining = len(text)
+    for character in text:
+        remaining -= 1
+        equal = vectors.get(character, 0)
+        vertical = equal | negative
+        horizontal = (((equal & positive) + positive) ^ positive) | equal
+        up = negative | ~(horizontal | positive)
+        down = positive & horizontal
+        if up & last:
+            distance += 1
+        elif down & last:
+            distance -= 1
+        if limit is not None and distance - remaining > limit:
+            return limit + 1
+        up = up << 1 | 1
+        down <<= 1
+        positive = (down | ~(vertical | up)) & full
+        negative = up & vertical & full
+    return distance
+
+
+class batchScorer:
+    """Levenshtein distance of a query to every key at once, over a padded
+    code point matrix of the keys encoded when the menu loads, one row per
+    position in the names so the keys lie along the vectorized axis"""
+
+    def __init__(self, keys: list[str]) -> None:
+        if np is None:
+            raise ImportError("The batch scorer needs numpy")
+        width = max((len(key) for key in keys), default=0)
+        self.lengths = np.array([len(key) for key in keys], dtype=np.intp)
+        self.matrix = np.full((width, len(keys)), -1, dtype=np.int32)
+        for column, key in enumerate(keys):
+            self.matrix[:len(key), column] = [ord(c) for c in key]
+        self.steps = np.arange(width + 1, dtype=np.int16)[:, None]
+
+    def distances(self, query: str, keys=slice(None)):
+        """Computes the matrix one query character at a time for all the keys together.
+        Insertions chain along the name, so they are resolved with a running minimum
+        of distance - position instead of a loop over the positions"""
+        lengths = self.lengths[keys]
+        width = int(lengths.max(initial=0))
+        matrix = self.matrix[:width, keys]
+        steps = self.steps[:width + 1]
+        previous = np.repeat(steps, matrix.shape[1], axis=1)
+        current = np.empty_like(previous)
+        for i, character in enumerate(query, 1):
+            current[0] = i
+            np.minimum(previous[1:] + 1, previous[:-1] + (matrix != ord(character)), out=current[1:])
+            current -= steps
+            np.minimum.accumulate(current, axis=0, out=current)
+            current += steps
+            previous, current = current, previous
+        return previous[lengths, np.arange(matrix.shape[1])]
+
+    def near(self, query: str, limit: int) -> dict[int, int]:
+        """Scores the keys whose length is within limit of the query's"""
+        positions = np.flatnonzero(np.abs(self.lengths - len(query)) <= limit)
+        distances = self.distances(query, positions)
+        close = distances <= limit
+        return dict(zip(positions[close].tolist(), distances[close].tolist()))
+
+
+class searchIndex:
+    """Inverted index over the service names, used to find the few names
+    worth scoring with the edit distance.
+
+    Within edit distance d, a name shares at least max(len(query), len(name)) - d
+    characters with the query (the bag distance bound), which is counted for all the
+    names at once over per-character bitsets. Names containing the query are found
+    by intersecting the postings of its trigrams.
+
+    With vectorized, the names about as long as the query are all scored by the
+    batchScorer instead, at a cost that does not depend on how alike they are."""
+
+    def __init__(self, database: dict, vectorized: bool = False) -> None:
+        self.codes = list(database.keys())
+        self.names = list(database.values())
+        self.keys = [normalize(name) for name in self.names]
+        self.scorer = batchScorer(self.keys) if vectorized else None
+        self.all = (1 << len(self.keys)) - 1
+        self.by_length: dict[int, int] = {}  # length -> bitset of the keys
+        self.characters: dict[str, list[int]] = {}  # character -> bitsets of the keys holding it at least 1, 2.. times
+        self.postings: dict[str, set[int]] = {}  # trigram -> positions of the keys
+        for position, key in enumerate(self.keys):
+            bit = 1 << position
+            self.by_length[len(key)] = self.by_length.get(len(key), 0) | bit
+            for character in set(key):
+                masks = self.characters.setdefault(character, [])
+                for times in range(key.count(character)):
+                    if times == len(masks):
+                        masks.append(0)
+                    masks[times] |= bit
+            for gram in grams(key):
+                self.postings.setdefault(gram, set()).add(position)
+
+    @staticmethod
+    def _positions(bits: int):
+        while bits:
+            low = bits & -bits
+            yield low.bit_length() - 1
+            bits ^= low
+
+    def _shared_counts(self, query: str) -> list[int]:
+        """Bit-sliced count, for every key, of the characters it shares with the query"""
+        slices = [0] * len(query).bit_length()
+        for character in set(query):
+            masks = self.characters.get(character, [])
+            for times in range(min(query.count(character), len(masks))):
+                carry = masks[times]
+                for i in range(len(slices)):
+                    slices[i], carry = slices[i] ^ carry, slices[i] & carry
+                    if not carry:
+                        break
+        return slices
+
+    def _at_least(self, slices: list[int], count: int) -> int:
+        """Bitset of the keys whose bit-sliced count is at least count"""
+        if count <= 0:
+            return self.all
+        if count >= 1 << len(slices):
+            return 0
+        equal, greater = self.all, 0
+        for i in reversed(range(len(slices))):
+            if count >> i & 1:
+                equal &= slices[i]
+            else:
+                greater |= equal & slices[i]
+                equal &= ~slices[i]
+        return greater | equal
+
+    def _containing(self, query: str) -> list[int]:
+        """Positions of the keys that contain the query"""
+        if len(query) < GRAM:
+            return [position for position, key in enumerate(self.keys) if query in key]
+        candidates = None
+        for gram in sorted(grams(query), key=lambda g: len(self.postings.get(g, ()))):
+            found = self.postings.get(gram, ())
+            candidates = set(found) if candidates is None else candidates.intersection(found)
+            if not candidates:
+                return []
+        return [position for position in candidates if query in self.keys[position]]
+
+    def _near(self, query: str, limit: int) -> dict[int, int]:
+        """Positions of the keys within edit distance limit of the query, with their distance"""
+        if limit < 0:
+            return {}
+        if self.scorer is not None:
+            return self.scorer.near(query, limit)
+        slices = self._shared_counts(query)
+        candidates = 0
+        for length in range(max(len(query) - limit, 0), len(query) + limit + 1):
+            if length in self.by_length:
+                shared = max(len(query), length) - limit
+                candidates |= self.by_length[length] & self._at_least(slices, shared)
+        near = {}
+        vectors = match_vectors(query)
+        for position in self._positions(candidates):
+            distance = levenshtein(query, self.keys[position], vectors, limit)
+            if distance <= limit:
+                near[position] = distance
+        return near
+
+    def search(self, query_term: str, threshold: int = 80) -> list[list]:
+        """Returns [similarity, name, code] of the names similar to or containing the query,
+        the most similar first, with similarity = (len(query) - distance) / len(query) * 100"""
+        query = normalize(query_term)
+        if not query:
+            return []
+        limit = int(len(query) * (100 - threshold) / 100)
+        distances = self._near(query, limit)
+        for position in self._containing(query):
+            if position not in distances:
+                # Only insertions separate a query from a name containing it
+                distances[position] = len(self.keys[position]) - len(query)
+        ordered = sorted(distances.items(), key=lambda item: (item[1], item[0]))
+        return [[(len(query) - distance) / len(query) * 100, self.names[position], self.codes[position]]
+                for position, distance in ordered]
+
+
+class prefixIndex:
+    """Sorted array of the names, and of every word inside them, for the
+    names starting with what the user typed so far"""
+
+    def __init__(self, database: dict) -> None:
+        self.codes = list(database.keys())
+        self.names = list(database.values())
+        keys = [normalize(name) for name in self.names]
+        self.by_name = sorted(range(len(keys)), key=lambda position: (keys[position], position))
+        entries = []
+        for position, key in enumerate(keys):
+            for start in range(len(key)):
+                if start == 0 or not key[start - 1].isalnum() and key[start].isalnum():
+                    entries.append((key[start:], start != 0, position))
+        self.entries = sorted(entries)
+
+    def search(self, prefix: str) -> list[tuple[str, str]]:
+        """(name, code) of the names starting with the prefix, then of those
+        with a later word starting with it, alphabetically"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return [(self.names[position], self.codes[position]) for position in self.by_name]
+        first = bisect_left(self.entries, (prefix,))
+        matches = []
+        for fragment, inner, position in self.entries[first:]:
+            if not fragment.startswith(prefix):
+                break
+            matches.append((inner, fragment, position))
+        matches.sort()
+        seen = set()
+        found = []
+        for _, _, position in matches:
+            if position not in seen:
+                seen.add(position)
+                found.append((self.names[position], self.codes[position]))
+        return found
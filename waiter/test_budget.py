@@ -0,0 +1,25 @@
+import budget
+
+
+class clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_stages_dont_count_nested_time_twice(monkeypatch):
+    now = clock()
+    monkeypatch.setattr(budget.time, 'monotonic', now.monotonic)
+    with budget.begin(25.0) as spent:
+        with budget.stage('waiter'):
+            now.now += 1
+            with budget.stage('cook'):
+                now.now += 3
+                with budget.stage('telegram'):
+                    now.now += 2
+            with budget.outside():
+                with budget.stage('telegram'):
+                    now.now += 4
+    assert spent.stages == {'waiter': 1.0, 'cook': 3.0, 'telegram': 2.0}
@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+from . import callback_data as cd
+
+ALPHABET = 'ab_|\\1 €é-:*'
+
+
+def random_field(rng):
+    return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 8)))
+
+
+def test_round_trip_fuzz():
+    rng = random.Random(20)
+    opcodes = [cd.BUY, cd.REBUY, cd.CHECK, cd.CANCEL, cd.AGAIN, cd.ACTIVATE, cd.PAGE, cd.SHOWN]
+    for _ in range(5000):
+        opcode = rng.choice(opcodes)
+        fields = [random_field(rng) for _ in range(rng.randint(0, 7))]
+        try:
+            data = cd.encode(opcode, *fields)
+        except cd.CallbackDataError:
+            raw = cd.VERSION + opcode + ''.join('|' + cd.escape(field) for field in fields)
+            assert len(raw.encode('utf-8')) > cd.MAX_BYTES
+            continue
+        assert len(data.encode('utf-8')) <= cd.MAX_BYTES
+        assert cd.decode(data) == (opcode, fields)
+
+
+def test_random_data_never_crashes_the_decoder():
+    rng = random.Random(21)
+    for _ in range(5000):
+        data = ''.join(rng.choice(ALPHABET + cd.VERSION + 'bkp') for _ in range(rng.randint(0, 64)))
+        try:
+            decoded = cd.decode(data)
+        except cd.CallbackDataError:
+            continue
+        if decoded is not None:
+            opcode, fields = decoded
+            assert data.startswith(cd.VERSION + opcode)
+
+
+def test_legacy_data_is_not_decoded():
+    for legacy in ['p3', 'wantNumbers', '1k|2|123|919876543210|Tele_gram|12.5|Tiger|Any', 'buy_Tiger_Telegram_Any', 'chk2_1_2_a_b_c_d', 'cancel_1_a_2_b']:
+        assert cd.decode(legacy) is None
+
+
+def test_names_with_separators_survive():
+    data = cd.encode(cd.BUY, 'Tiger', 'chk_cancel|name\\', 'virtual_21')
+    assert cd.decode(data) == (cd.BUY, ['Tiger', 'chk_cancel|name\\', 'virtual_21'])
+    with pytest.raises(cd.CallbackDataError):
+        cd.encode(cd.BUY, 'x' * 64)
@@ -0,0 +1,43 @@
+from reception.main import UserDatabase, ProcessedUpdate
+from .dedup import updateDeduplicator
+
+
+def test_redeliveries_within_the_window_are_dropped():
+    deliveries = updateDeduplicator(window=3)
+    assert [deliveries.first_delivery({'update_id': i}) for i in [1, 2, 1, 3, 2]] == \
+        [True, True, False, True, False]
+    # 1 left the window of the last 3 ids
+    assert deliveries.first_delivery({'update_id': 4}) and deliveries.first_delivery({'update_id': 1})
+    assert deliveries.first_delivery({'message': {}})
+    stats = deliveries.stats()
+    assert stats['duplicates'] == 2 and stats['window'] == 3
+
+
+def test_workers_sharing_a_database_claim_each_update_once(tmp_path):
+    store = UserDatabase(f"sqlite:///{tmp_path / 'updates.db'}")
+    workers = [updateDeduplicator(window=8, store=store) for _ in range(3)]
+    accepted = [worker.first_delivery({'update_id': update_id})
+                for update_id in range(100, 140) for worker in workers]
+    assert accepted.count(True) == 40
+    assert all(worker.stats()['store_errors'] == 0 for worker in workers)
+    assert sum(worker.stats()['duplicates'] for worker in workers) == 80
+
+
+def test_failing_store_lets_updates_through():
+    class down:
+        def claim_update(self, update_id, keep):
+            raise ConnectionError("database is down")
+
+    deliveries = updateDeduplicator(store=down())
+    assert deliveries.first_delivery({'update_id': 1})
+    assert not deliveries.first_delivery({'update_id': 1})
+    assert deliveries.stats()['store_errors'] == 1
+
+
+def test_claimed_updates_are_pruned_whatever_their_ids(tmp_path):
+    store = UserDatabase(f"sqlite:///{tmp_path / 'updates.db'}")
+    # Odd ids only, none of them a multiple of keep
+    for update_id in range(1, 200, 2):
+        assert store.claim_update(update_id, keep=8)
+    with store.Session() as session:
+        assert session.query(ProcessedUpdate).count() <= 16
@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+import budget
+from telegram.bot import bot, TELEGRAM_TIMEOUT
+from reception.main import api_point
+from . import callback_data as cd, helper_phone, query_handler
+
+
+class callback:
+    def __init__(self, data, chat_id=7) -> None:
+        self.data = data
+        self.chat_id = chat_id
+        self.message_id = 55
+        self.callback_query_id = 'cq'
+        self.from_user_username = 'user'
+
+
+class provider:
+    """Stands in for serviceOps, the number is always canceled"""
+
+    def getOTP(self, server, access_id):
+        return -1
+
+    def cancelPhone(self, server, access_id):
+        return True
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = api_point(f"sqlite:///{tmp_path / 'users.db'}")
+    store.user_db.add_user(7)
+    store.user_db.record_transaction(7, 'Recharge', 100)
+    for module in (helper_phone, query_handler):
+        monkeypatch.setattr(module, 'reception_api', store)
+        monkeypatch.setattr(module, 'serviceOps', provider())
+    monkeypatch.setattr(helper_phone, 'OTP_POLLER', False)
+    return store
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    sent = []
+
+    def send_request(method, data, timeout=TELEGRAM_TIMEOUT):
+        # Like the bot, refuses to call when the update has no time left
+        budget.timeout(timeout)
+        sent.append((method, data))
+        return {'ok': True, 'result': {'message_id': 55}}
+
+    monkeypatch.setattr(bot, 'send_request', send_request)
+    monkeypatch.setattr(bot, 'send_message', lambda chat_id, text: sent.append(('sendMessage', {'text': text})))
+    return sent
+
+
+def credited(store, user_id):
+    """The balance, which the database keeps by a trigger in production"""
+    return sum(t.amount_credited for t in store.user_db.get_user_transactions(user_id))
+
+
+def click(data, chat_id=7):
+    handler, fields = query_handler.route(data)
+    return handler(callback(data, chat_id), *fields)
+
+
+@pytest.mark.parametrize('data', ['chk1_555_919876543210_Telegram_9999_Tiger_Any',
+                                  'cancel_555_Telegram_9999_Tiger'])
+def test_forged_legacy_buttons_credit_nothing(store, sent, data):
+    click(data)
+    click(data)
+    assert credited(store, 7) == pytest.approx(100)
+    assert not any('money refunded' in str(payload.get('text')) for _, payload in sent)
+
+
+def test_issued_number_is_refunded_once(store, sent):
+    helper_phone.sendMessageforNumber(7, 'user', '919876543210', 'Telegram', 12.5, '556', 'Tiger', 'Any')
+    assert credited(store, 7) == pytest.approx(87.5)
+    activation = store.user_db.find_activation('Tiger', '556')
+    check = f"2k|{activation['id']}|1"
+    click(check)
+    click(check)
+    click(f"2x|{activation['id']}")
+    assert credited(store, 7) == pytest.approx(100)
+    # Someone else's activation id is refused
+    click(check, chat_id=8)
+    assert sent[-1][1]['text'] == "This number is not available anymore"
+
+
+def test_bought_number_is_delivered_when_the_budget_runs_out(store, sent):
+    with budget.begin(0.01):
+        time.sleep(0.02)
+        helper_phone.sendMessageforNumber(7, 'user', '919876543210', 'Telegram', 12.5, '557', 'Tiger', 'Any')
+    method, payload = sent[-1]
+    assert method == 'sendMessage' and '9876543210' in payload['text']
+    assert store.user_db.find_activation('Tiger', '557') is not None
+
+
+def test_cancel_stops_the_otp_poller(store, sent):
+    helper_phone.sendMessageforNumber(7, 'user', '919876543210', 'Telegram', 12.5, '558', 'Tiger', 'Any')
+    activation = store.user_db.find_activation('Tiger', '558')
+    poller = helper_phone.otp_poller
+    poller.track('Tiger', '558', activation_id=activation['id'], message_id=55)
+    click(f"2x|{activation['id']}")
+    assert ('Tiger', '558') not in poller._active
+    # A poll already under way when the user canceled refunds nothing more
+    helper_phone.pushOtpUpdate({'activation_id': activation['id'], 'message_id': 55, 'n': 1}, -1)
+    assert credited(store, 7) == pytest.approx(100)
+
+
+def test_buttons_of_the_shown_page_are_only_answered(sent):
+    services = query_handler.services
+    for page in range(1, services.total_pages + 1):
+        buttons = [data for row in services.get_button_rows(page) for _, data in row]
+        assert cd.encode(cd.PAGE, page) not in buttons
+        assert cd.encode(cd.SHOWN) in buttons
+    click(cd.encode(cd.SHOWN))
+    assert sent == [('answerCallbackQuery', {'callback_query_id': 'cq'})]
@@ -0,0 +1,105 @@
+import threading
+
+import pytest
+
+from .dedup import updateDeduplicator
+from .polling import updatePoller
+from .workers import workerPool
+
+
+class standIn:
+    """Answers getUpdates like Telegram, from a list of batches"""
+
+    def __init__(self, batches, webhook_failures=0) -> None:
+        self.batches = list(batches)
+        self.webhook_failures = webhook_failures
+        self.calls = []
+        self.poller = None
+
+    def send_request(self, method, data, timeout=None):
+        self.calls.append((method, dict(data)))
+        if method == 'deleteWebhook' and self.webhook_failures:
+            self.webhook_failures -= 1
+            return "Failed Request to TG API"
+        if method != 'getUpdates' or data.get('timeout') == 0:
+            return {'ok': True, 'result': True}
+        if not self.batches:
+            self.poller.stop()
+            return {'ok': True, 'result': []}
+        batch = self.batches.pop(0)
+        if batch is None:
+            return "Failed Request to TG API"
+        return {'ok': True, 'result': batch}
+
+
+def updates(*ids):
+    return [{'update_id': i, 'message': {'chat': {'id': i % 3}, 'text': '/start'}} for i in ids]
+
+
+def test_offsets_are_confirmed_after_queuing(monkeypatch):
+    monkeypatch.setattr('waiter.polling.time.sleep', lambda seconds: None)
+    handled = []
+    lock = threading.Lock()
+
+    def handle(update):
+        with lock:
+            handled.append(update['update_id'])
+
+    api = standIn([updates(10, 11, 12), None, updates(13), updates(14, 15)])
+    pool = workerPool(handle, workers=2, queue_depth=1, name='test', key=lambda u: u['message']['chat']['id'])
+    poller = updatePoller(pool=pool, accept=lambda update: update['update_id'] != 14, api=api, timeout=5)
+    api.poller = poller
+    poller.run()
+
+    assert api.calls[0][0] == 'deleteWebhook'
+    offsets = [data.get('offset') for method, data in api.calls if method == 'getUpdates']
+    # the failed call is retried with the same offset, the last call confirms 15
+    assert offsets == [None, 13, 13, 14, 16, 16]
+    assert sorted(handled) == [10, 11, 12, 13, 15]
+    stats = poller.stats()
+    assert stats['received'] == 6 and stats['errors'] == 1 and stats['batches'] == 4
+
+
+def test_getupdates_waits_for_the_webhook_to_be_deleted(monkeypatch):
+    monkeypatch.setattr('waiter.polling.time.sleep', lambda seconds: None)
+    api = standIn([updates(20)], webhook_failures=2)
+    pool = workerPool(lambda update: None, workers=1, queue_depth=4, name='test')
+    poller = updatePoller(pool=pool, accept=lambda update: True, api=api, timeout=5)
+    api.poller = poller
+    poller.run()
+    methods = [method for method, _ in api.calls]
+    assert methods[:4] == ['deleteWebhook', 'deleteWebhook', 'deleteWebhook', 'getUpdates']
+    assert poller.stats()['errors'] == 2 and poller.offset == 21
+
+
+def test_update_held_at_stop_is_released_for_its_redelivery(monkeypatch):
+    deliveries = updateDeduplicator(window=8)
+    # No workers, so the queue stays full
+    pool = workerPool(lambda update: None, workers=0, queue_depth=1, name='test')
+    assert pool.submit(updates(31)[0])
+    poller = updatePoller(pool=pool, accept=deliveries.first_delivery, release=deliveries.release,
+                          api=standIn([]), timeout=5)
+    poller.running = True
+    monkeypatch.setattr('waiter.polling.time.sleep', lambda seconds: poller.stop())
+    poller.enqueue(updates(32))
+    assert poller.offset is None
+    # Delivered again after a restart, it isn't taken for a duplicate
+    assert deliveries.first_delivery(updates(32)[0])
+
+
+def test_update_held_at_ctrl_c_is_released_for_its_redelivery(monkeypatch):
+    deliveries = updateDeduplicator(window=8)
+    pool = workerPool(lambda update: None, workers=0, queue_depth=1, name='test')
+    assert pool.submit(updates(41)[0])
+    poller = updatePoller(pool=pool, accept=deliveries.first_delivery, release=deliveries.release,
+                          api=standIn([]), timeout=5)
+    poller.running = True
+
+    def interrupt(seconds):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr('waiter.polling.time.sleep', interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        poller.enqueue(updates(42))
+    assert poller.offset is None
+    assert deliveries.first_delivery(updates(42)[0])
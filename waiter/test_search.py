@@ -0,0 +1,87 @@
+import hashlib
+import random
+from os import path
+
+import pytest
+
+from .search import searchIndex, prefixIndex, normalize, levenshtein as bit_parallel_levenshtein
+
+MENU = path.join(path.dirname(path.realpath(__file__)), "menu.txt")
+
+
+def load_menu():
+    with open(MENU, 'r', encoding='utf-8') as file:
+        names = [line.strip() for line in file if line.strip()]
+    return {hashlib.sha256(name.encode()).hexdigest()[:7]: name for name in names}
+
+
+def levenshtein(str1, str2):
+    """The full matrix distance the bot searched with before the index"""
+    d = [[0] * (len(str1) + 1) for _ in range(len(str2) + 1)]
+    for i in range(len(str1) + 1):
+        d[0][i] = i
+    for j in range(len(str2) + 1):
+        d[j][0] = j
+    for j in range(1, len(str2) + 1):
+        for i in range(1, len(str1) + 1):
+            d[j][i] = min(d[j - 1][i] + 1, d[j][i - 1] + 1,
+                          d[j - 1][i - 1] + (str1[i - 1] != str2[j - 1]))
+    return d[-1][-1]
+
+
+def linear_search(database, query_term, threshold):
+    matches = []
+    for code, name in database.items():
+        distance = levenshtein(query_term.lower(), name.lower())
+        similarity = ((len(query_term) - distance) / len(query_term)) * 100
+        if similarity >= threshold or query_term.lower() in name.lower():
+            matches.append(code)
+    return matches
+
+
+database = load_menu()
+index = searchIndex(database)
+QUERIES = ['telegram', 'whatsapp', 'amazon', 'paytm', 'tinder', 'googel', 'facbook', 'zomato',
+           'swigy', 'ola', 'bet', 'x', 'flipkart', 'instagram', 'microsoft', 'uber eats', 'netflix']
+
+
+@pytest.mark.parametrize('query', QUERIES)
+@pytest.mark.parametrize('threshold', [50, 80])
+def test_finds_everything_the_linear_scan_found(query, threshold):
+    found = {code for _, _, code in index.search(query, threshold)}
+    assert set(linear_search(database, query, threshold)) <= found
+
+
+def test_homoglyphs_are_folded():
+    assert normalize('163сom') == normalize('163COM')
+    assert '1хbet' in [name for _, name, _ in index.search('1xbet')]
+    assert 'Zédelivery' in [name for _, name, _ in index.search('zedelivery')]
+
+
+def test_bit_parallel_levenshtein_matches_full_distance():
+    rng = random.Random(7)
+    for _ in range(2000):
+        a = ''.join(rng.choice('abc') for _ in range(rng.randint(0, 12)))
+        b = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 12)))
+        limit = rng.randint(0, 5)
+        assert bit_parallel_levenshtein(a, b) == levenshtein(a, b)
+        assert bit_parallel_levenshtein(a, b, limit=limit) == min(levenshtein(a, b), limit + 1)
+
+
+def test_batch_scorer_agrees_with_the_index():
+    pytest.importorskip('numpy')
+    vectorized = searchIndex(database, vectorized=True)
+    for query in QUERIES + ['1xbet', 'zedelivery', 'qqqqqqqq']:
+        for threshold in [0, 50, 80, 100]:
+            assert vectorized.search(query, threshold) == index.search(query, threshold)
+
+
+def test_prefix_index_completes_names_and_words():
+    prefixes = prefixIndex(database)
+    assert prefixes.search('tele')[:2] == [('Telegram', 'acdd1e7'), ('Telegram 2.0', '73a13b0')]
+    assert '1хbet' in [name for name, _ in prefixes.search('1x')]
+    for prefix in ['a', 'go', 'pay', '2.0']:
+        expected = {code for code, name in database.items()
+                    if any(word.startswith(prefix) for word in [normalize(name)] + normalize(name).split())}
+        assert expected <= {code for _, code in prefixes.search(prefix)}
+    assert len(prefixes.search('')) == len(database)
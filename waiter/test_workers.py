@@ -0,0 +1,85 @@
+import threading
+import time
+
+from .workers import workerPool
+
+
+def test_full_queue_sheds_and_nothing_is_lost():
+    release = threading.Event()
+    handled = []
+    lock = threading.Lock()
+
+    def handle(item):
+        release.wait(5)
+        with lock:
+            handled.append(item)
+
+    pool = workerPool(handle, workers=2, queue_depth=3, name='test')
+    accepted = [item for item in range(10) if pool.submit(item)]
+    # Two items may be taken by the workers before the queue fills
+    assert 3 <= len(accepted) <= 5
+    assert pool.stats()['shed'] == 10 - len(accepted)
+    release.set()
+    pool.join()
+    assert sorted(handled) == accepted
+    stats = pool.stats()
+    assert stats['done'] == len(accepted) and stats['busy'] == 0 and stats['queue_depth'] == 0
+    assert len(pool._threads) == 2
+
+
+def test_failures_do_not_kill_the_workers():
+    pool = workerPool(lambda item: 1 / item, workers=1, queue_depth=8, name='test')
+    for item in [0, 1, 0, 2]:
+        assert pool.submit(item)
+    pool.join()
+    stats = pool.stats()
+    assert stats['failed'] == 2 and stats['done'] == 4
+    assert 0 <= stats['utilization'] <= 1
+
+
+def test_keys_run_in_order_and_apart_in_parallel():
+    running = {}
+    overlaps = []
+    order = {}
+    lock = threading.Lock()
+    both_started = threading.Barrier(2, timeout=5)
+
+    def handle(item):
+        key, n = item
+        with lock:
+            if running.get(key):
+                overlaps.append(item)
+            running[key] = True
+        if n == 0:
+            # Only passes when the first items of both keys run at once
+            both_started.wait()
+        time.sleep(0.001)
+        with lock:
+            running[key] = False
+            order.setdefault(key, []).append(n)
+
+    pool = workerPool(handle, workers=4, queue_depth=100, name='test',
+                      key=lambda item: item[0], key_depth=50)
+    for n in range(30):
+        for key in ('a', 'b'):
+            assert pool.submit((key, n))
+    pool.join()
+    assert not overlaps
+    assert order == {'a': list(range(30)), 'b': list(range(30))}
+    assert pool.stats()['keys'] == 0 and not pool._lines
+
+
+def test_keys_and_lines_are_bounded():
+    release = threading.Event()
+    pool = workerPool(lambda item: release.wait(5), workers=1, queue_depth=100, name='test',
+                      key=lambda item: item[0], max_keys=2, key_depth=2)
+    assert pool.submit(('a', 0)) and pool.submit(('a', 1)) and pool.submit(('b', 0))
+    assert not pool.submit(('c', 0))
+    # a's line holds 2 items, one of which may already be running
+    accepted = sum(pool.submit(('a', n)) for n in range(2, 5))
+    assert accepted <= 1
+    release.set()
+    pool.join()
+    assert pool.submit(('c', 1))
+    pool.join()
+    assert pool.stats()['keys'] == 0
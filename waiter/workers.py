@@ -0,0 +1,142 @@
+"""Fixed pool of threads working the updates off a bounded queue"""
+import queue
+import threading
+import time
+from collections import deque
+
+from telegram.bot import logger
+from secrets_handler import get_setting
+
+UPDATE_WORKERS = get_setting('UPDATE_WORKERS', 16)
+UPDATE_QUEUE_DEPTH = get_setting('UPDATE_QUEUE_DEPTH', 64)
+# Chats with updates queued or running, and the updates each may queue
+UPDATE_MAX_CHATS = get_setting('UPDATE_MAX_CHATS', 1024)
+UPDATE_CHAT_DEPTH = get_setting('UPDATE_CHAT_DEPTH', 8)
+
+
+class workerPool:
+    """Runs handle(item) on a fixed number of threads. Items wait in a
+    queue of at most queue_depth, submit refuses them once it is full so
+    that the caller can shed the load.
+
+    Items of the same key(item) run one at a time in the order they were
+    submitted, items of different keys run in parallel. Each key holds a
+    line of at most key_depth items, and at most max_keys lines exist at
+    once; a line is dropped as soon as it runs empty. Items whose key is
+    None, or every item without a key function, have no order.
+
+    The threads start on the first submit, not in the process that
+    imports the module and may fork the workers."""
+
+    def __init__(self, handle, workers: int = UPDATE_WORKERS,
+                 queue_depth: int = UPDATE_QUEUE_DEPTH, name: str = 'worker',
+                 key=None, max_keys: int = UPDATE_MAX_CHATS,
+                 key_depth: int = UPDATE_CHAT_DEPTH) -> None:
+        self.handle = handle
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.name = name
+        self.key = key
+        self.max_keys = max_keys
+        self.key_depth = key_depth
+        self._lines = {}  # key -> deque of (item, queued_at), while queued or running
+        self._ready = queue.SimpleQueue()  # keys whose next item can run
+        self._threads = []
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self.started = None
+        self.queued = 0
+        self.busy = 0
+        self.busy_total = 0.0
+        self.submitted = 0
+        self.shed = 0
+        self.done = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def submit(self, item) -> bool:
+        """Queues the item, False when the queue, its key's line or
+        the number of keys is full"""
+        self._ensure_running()
+        key = self.key(item) if self.key else None
+        with self._lock:
+            if key is None:
+                key = object()
+            line = self._lines.get(key)
+            if (self.queued >= self.queue_depth
+                    or (line is None and len(self._lines) >= self.max_keys)
+                    or (line is not None and len(line) >= self.key_depth)):
+                self.shed += 1
+                return False
+            self.queued += 1
+            self.submitted += 1
+            if line is None:
+                self._lines[key] = deque([(item, time.monotonic())])
+                self._ready.put(key)
+            else:
+                # The line is running or ready, its worker takes the item next
+                line.append((item, time.monotonic()))
+        return True
+
+    def join(self):
+        """Waits until every queued item is handled"""
+        with self._idle:
+            while self.queued or self.busy:
+                self._idle.wait()
+
+    def _ensure_running(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            if self.started is None:
+                self.started = time.monotonic()
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True,
+                                          name=f'{self.name}-{len(self._threads)}')
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            key = self._ready.get()
+            with self._lock:
+                item, queued_at = self._lines[key].popleft()
+                started = time.monotonic()
+                self.queued -= 1
+                self.busy += 1
+                self.wait_total += started - queued_at
+                self.wait_max = max(self.wait_max, started - queued_at)
+            try:
+                self.handle(item)
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                logger.exception("%s failed on an item", self.name)
+            finally:
+                with self._lock:
+                    self.busy -= 1
+                    self.busy_total += time.monotonic() - started
+                    self.done += 1
+                    if self._lines[key]:
+                        self._ready.put(key)
+                    else:
+                        del self._lines[key]
+                    self._idle.notify_all()
+
+    def stats(self) -> dict:
+        with self._lock:
+            uptime = time.monotonic() - self.started if self.started else 0.0
+            return {
+                'workers': self.workers,
+                'busy': self.busy,
+                'queue_depth': self.queued,
+                'queue_limit': self.queue_depth,
+                'keys': len(self._lines),
+                'submitted': self.submitted,
+                'shed': self.shed,
+                'done': self.done,
+                'failed': self.failed,
+                'avg_wait': round(self.wait_total / self.done, 4) if self.done else 0.0,
+                'max_wait': round(self.wait_max, 4),
+                'utilization': round(self.busy_total / (uptime * self.workers), 4) if uptime else 0.0,
+            }